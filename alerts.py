@@ -0,0 +1,237 @@
+import asyncio
+import collections
+import time
+import metrics
+
+# discord rejects messages longer than this
+max_message_chars = 2000
+
+# seconds alerts are collected for before they go out together
+coalesce_window = 1.0
+
+# alerts waiting to be sent, the oldest ones are dropped once this many are queued
+max_queued_alerts = 1000
+
+# messages a MemorySink keeps, the older ones are only counted
+memory_sink_messages = 1000
+
+# discord allows 5 messages per 5 seconds on a channel
+min_send_interval = 1.0
+
+# seconds after an alert before the same symbol is alerted again without escalating
+alert_cooldown = 15 * 60
+
+# an alert within the cooldown escalates when its move is this many times the last one's
+escalation_factor = 1.0
+
+# seconds the last alert of a symbol is remembered, and how many are remembered at most
+alert_state_ttl = 24 * 60 * 60
+max_alert_states = 100000
+
+
+# sends messages to a discord channel as code blocks
+class DiscordSink:
+
+    prefix = '```'
+    suffix = '```'
+
+    def __init__(self, client, channel_id, min_interval=None):
+        self.client = client
+        self.channel_id = channel_id
+        self.min_interval = min_send_interval if min_interval is None else min_interval
+        self.last_sent = 0.0
+
+    async def send(self, text):
+        wait = self.last_sent + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        channel = self.client.get_channel(self.channel_id)
+        print('Sending Results to Discord Channel - ', channel)
+        try:
+            with metrics.timer('discord_send'):
+                await channel.send(self.prefix + text + self.suffix)
+        finally:
+            self.last_sent = time.monotonic()
+
+    # seconds to wait before retrying after a rate limit (429), None for any other error
+    def retry_after(self, e):
+        if getattr(e, 'status', None) != 429:
+            return None
+        headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+        for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+            if header in headers:
+                return float(headers[header])
+        return 1.0
+
+
+# local stand-in for discord, keeps the last max_messages messages it is sent and counts them all
+class MemorySink:
+
+    prefix = ''
+    suffix = ''
+
+    def __init__(self, max_messages=None):
+        self.messages = collections.deque(maxlen=max_messages or memory_sink_messages)
+        self.sent = 0
+
+    async def send(self, text):
+        self.messages.append(text)
+        self.sent += 1
+
+    def retry_after(self, e):
+        return None
+
+
+# the last alert of every (strategy, key) so repeats can be dropped before they are formatted
+# an alert about the same bar as the last one, or within the cooldown after it, is a repeat unless
+# it escalates: a new high of its level (ex. the price) or a move escalation_factor times larger
+# the entries are kept in the order they were alerted, so the ones older than the ttl (and the
+# oldest ones once there are max_entries) are evicted from the front in O(1)
+class AlertState:
+
+    def __init__(self, cooldown=None, ttl=None, max_entries=None):
+        self.cooldown = alert_cooldown if cooldown is None else cooldown
+        self.ttl = alert_state_ttl if ttl is None else ttl
+        self.max_entries = max_entries or max_alert_states
+        # (strategy, key) -> (alert time, bar, level, move)
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _evict(self, now):
+        entries = self.entries
+        while entries and (len(entries) > self.max_entries or next(iter(entries.values()))[0] < now - self.ttl):
+            entries.popitem(last=False)
+
+    # returns whether the alert goes out and remembers it if so
+    # bar identifies the bar the alert is about, level and move are None when they do not apply
+    def allow(self, strategy, key, bar, level=None, move=None, now=None):
+        now = time.time() if now is None else now
+        self._evict(now)
+        last = self.entries.get((strategy, key))
+        if last is not None:
+            last_time, last_bar, last_level, last_move = last
+            escalated = ((level is not None and last_level is not None and level > last_level) or
+                         (move is not None and last_move is not None and
+                          abs(move) > abs(last_move) * escalation_factor))
+            if not escalated and (bar == last_bar or now - last_time < self.cooldown):
+                metrics.inc('scanner_alerts_suppressed_total', strategy=strategy)
+                return False
+            del self.entries[(strategy, key)]
+        self.entries[(strategy, key)] = (now, bar, level, move)
+        self._evict(now)
+        return True
+
+    # the entries to save, only the ones still within the ttl
+    def state(self):
+        self._evict(time.time())
+        return list(self.entries.items())
+
+    def restore(self, entries):
+        self.entries.update(entries)
+        self._evict(time.time())
+
+
+# splits messages into as few texts as possible of at most limit characters
+# messages are kept whole where they fit, longer ones are split on line breaks
+def pack_messages(messages, limit):
+    parts = []
+    for message in messages:
+        if len(message) <= limit:
+            parts.append(message)
+            continue
+        chunk = ''
+        for line in message.split('\n'):
+            while len(line) > limit:
+                if chunk:
+                    parts.append(chunk)
+                    chunk = ''
+                parts.append(line[:limit])
+                line = line[limit:]
+            if chunk and len(chunk) + 1 + len(line) > limit:
+                parts.append(chunk)
+                chunk = line
+            else:
+                chunk = chunk + '\n' + line if chunk else line
+        if chunk:
+            parts.append(chunk)
+
+    texts = []
+    for part in parts:
+        if texts and len(texts[-1]) + 2 + len(part) <= limit:
+            texts[-1] += '\n\n' + part
+        else:
+            texts.append(part)
+    return texts
+
+
+# queues alerts without blocking the scanners and sends them from its own task
+# alerts arriving within the coalesce window are packed into as few messages as the sink allows
+class AlertDispatcher:
+
+    def __init__(self, sink, window=None, max_chars=None, max_queued=None, echo=True):
+        self.sink = sink
+        self.window = coalesce_window if window is None else window
+        self.limit = (max_message_chars if max_chars is None else max_chars) - len(sink.prefix) - len(sink.suffix)
+        self.queue = collections.deque(maxlen=max_queued or max_queued_alerts)
+        self.echo = echo
+        self.ready = None
+        self.idle = None
+        self.task = None
+
+    # starts the sender task on the running loop (or the given one)
+    def start(self, loop=None):
+        if self.task is None:
+            loop = loop or asyncio.get_event_loop()
+            self.ready = asyncio.Event()
+            self.idle = asyncio.Event()
+            self.idle.set()
+            self.task = loop.create_task(self.run())
+        return self.task
+
+    # queues an alert and returns at once, the sender starts with the first alert
+    # event_time (a datetime) is when the bar the alert is about started or closed, the time
+    # from it to the alert being sent is kept as the alert latency of the strategy
+    def submit(self, message, event_time=None, strategy='alert'):
+        if self.echo:
+            print(message)
+        self.start()
+        self.queue.append((message, event_time, strategy))
+        self.idle.clear()
+        self.ready.set()
+
+    async def _deliver(self, text):
+        while True:
+            try:
+                await self.sink.send(text)
+                return
+            except Exception as e:
+                delay = self.sink.retry_after(e)
+                if delay is None:
+                    print('Failed to send alert: ', e)
+                    return
+                await asyncio.sleep(delay)
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                self.idle.set()
+                self.ready.clear()
+                await self.ready.wait()
+            # let the rest of the burst arrive before packing
+            await asyncio.sleep(self.window)
+            batch = list(self.queue)
+            self.queue.clear()
+            for text in pack_messages([message for message, _, _ in batch], self.limit):
+                await self._deliver(text)
+            sent = time.time()
+            for _, event_time, strategy in batch:
+                metrics.inc('scanner_alerts_total', strategy=strategy)
+                if event_time is not None:
+                    metrics.observe('scanner_alert_latency_seconds', sent - event_time.timestamp(), strategy=strategy)
+
+    # waits until everything queued so far has been sent
+    async def flush(self):
+        if self.task is not None:
+            await self.idle.wait()
@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from bar_store import BarStore
+from crossover import compute_crossovers, session_hours
+from panel import build_panel
+
+# bars after a signal the forward returns are measured over
+forward_bars = (1, 5, 10)
+
+# symbols handled by one worker task
+chunk_size = 250
+
+SIGNAL_COLUMNS = ['timestamp', 'symbol', 'dir', 'close', 'price_change', 'perc_change', 'volume', 'rsi']
+
+
+# evaluates every crossover of a chunk of symbols, runs in a worker process
+# the bars are read from the store inside the worker so only the signals are sent back
+def _backtest_chunk(root, timeframe, symbols, _from, sma_fast, sma_slow, price_change_threshold, horizons):
+    store = BarStore(root)
+    history = {symbol: store.read(symbol, timeframe, _from) for symbol in symbols}
+    panel = build_panel(history, symbols, session_hours=session_hours)
+    if panel.shape[1] == 0:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS + ['fwd_{}'.format(h) for h in horizons])
+
+    indicators = compute_crossovers(panel, sma_fast, sma_slow)
+    close = panel['close']
+    signals = (indicators['up'] | indicators['down']) & (np.abs(indicators['price_change']) > price_change_threshold)
+    rows, cols = np.nonzero(signals)
+
+    signals_df = pd.DataFrame({
+        'timestamp': panel.times(rows, cols),
+        'symbol': np.array(panel.symbols, dtype=object)[rows],
+        'dir': np.where(indicators['up'][rows, cols], 'Up', 'Down'),
+        'close': close[rows, cols],
+        'price_change': indicators['price_change'][rows, cols],
+        'perc_change': indicators['perc_change'][rows, cols],
+        'volume': panel['volume'][rows, cols],
+        'rsi': indicators['rsi'][rows, cols],
+    })
+
+    # % return from the signal bar's close to the close h bars later (nan past the end of the data)
+    width = close.shape[1]
+    for h in horizons:
+        ahead = cols + h
+        future = np.full(len(rows), np.nan)
+        inside = ahead < width
+        future[inside] = close[rows[inside], ahead[inside]]
+        signals_df['fwd_{}'.format(h)] = (future / signals_df['close'].values - 1) * 100
+    return signals_df
+
+
+# evaluates every 13/30 crossover of the stored bars from _from onwards for all the symbols
+# the symbols are split into chunks that are scanned in parallel, one process per cpu core by default
+# returns one row per signal with the forward returns after forward_bars bars
+def backtest_crossovers(symbols, sma_fast=13, sma_slow=30, price_change_threshold=.10, _from=None,
+                        timeframe='60minute', horizons=forward_bars, store=None, workers=None):
+    store = store or BarStore()
+    chunks = [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_backtest_chunk, store.root, timeframe, chunk, _from,
+                            sma_fast, sma_slow, price_change_threshold, horizons)
+            for chunk in chunks
+        ]
+        results = [future.result() for future in futures]
+    if not results:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS + ['fwd_{}'.format(h) for h in horizons])
+    return pd.concat(results, ignore_index=True).sort_values(['timestamp', 'symbol'], ignore_index=True)
+
+
+# signal count, average forward return and hit rate (return in the signal's direction) by direction
+def summarize(signals, horizons=forward_bars):
+    summary = {}
+    for direction, group in signals.groupby('dir'):
+        row = {'signals': len(group)}
+        sign = 1 if direction == 'Up' else -1
+        for h in horizons:
+            returns = group['fwd_{}'.format(h)].dropna()
+            row['avg_fwd_{}'.format(h)] = returns.mean()
+            row['hit_fwd_{}'.format(h)] = (sign * returns > 0).mean() * 100
+        summary[direction] = row
+    return pd.DataFrame.from_dict(summary, orient='index')
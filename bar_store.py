@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from bars import BAR_DTYPE, BAR_COLUMNS, compact_volume, frame_to_records, records_to_frame, tz
+from fetcher import fetch_all
+import metrics
+
+# directory the bar files are kept in
+bar_store_dir = os.getenv('BAR_STORE_DIR', 'bar_store')
+
+
+# returns the key a bar series is stored under, ex. 60minute or 1day
+def timeframe_key(multiplier, timespan):
+    return '{}{}'.format(multiplier, timespan)
+
+
+# converts bar records of another layout (the float64 one the store used to write) to BAR_DTYPE
+def _convert(records):
+    converted = np.empty(len(records), dtype=BAR_DTYPE)
+    converted['timestamp'] = records['timestamp']
+    for column in BAR_COLUMNS:
+        converted[column] = records[column] if column != 'volume' else compact_volume(records[column])
+    return converted
+
+
+# persistent bar store with one memory-mappable .npy file per symbol and timeframe
+# it remembers the last stored bar so later runs only ask the api for the missing range
+class BarStore:
+
+    def __init__(self, root=None):
+        self.root = root or bar_store_dir
+        self.last = {}
+        self.coverage = {}
+        self.lock = threading.Lock()
+
+    def _path(self, symbol, timeframe):
+        return os.path.join(self.root, timeframe, '{}.npy'.format(symbol))
+
+    # returns the stored bars for a symbol (memory mapped, read only)
+    # files written in the old float64 layout are converted and rewritten compact on first load
+    def load(self, symbol, timeframe):
+        path = self._path(symbol, timeframe)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=BAR_DTYPE)
+        records = np.load(path, mmap_mode='r')
+        if records.dtype != BAR_DTYPE:
+            records = self._save(path, _convert(records))
+        return records
+
+    def _coverage_path(self, timeframe):
+        return os.path.join(self.root, timeframe, 'coverage.json')
+
+    # returns the epoch ms each symbol's stored history has been fetched from, by symbol
+    def covered_from(self, timeframe):
+        if timeframe not in self.coverage:
+            path = self._coverage_path(timeframe)
+            if os.path.exists(path):
+                with open(path) as f:
+                    self.coverage[timeframe] = json.load(f)
+            else:
+                self.coverage[timeframe] = {}
+        return self.coverage[timeframe]
+
+    def _save_coverage(self, timeframe):
+        path = self._coverage_path(timeframe)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.covered_from(timeframe), f)
+        os.replace(path + '.tmp', path)
+
+    # returns the epoch ms of the last stored bar or None if nothing is stored yet
+    def last_timestamp(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.last:
+            records = self.load(symbol, timeframe)
+            self.last[key] = int(records['timestamp'][-1]) if len(records) else None
+        return self.last[key]
+
+    # merges new bars into the store, rows at or after the first new bar are replaced
+    def write(self, symbol, timeframe, records):
+        if len(records) == 0:
+            return
+        records = np.sort(records, order='timestamp')
+        existing = self.load(symbol, timeframe)
+        keep = existing[existing['timestamp'] < records['timestamp'][0]]
+        merged = np.concatenate([keep, records])
+
+        self._save(self._path(symbol, timeframe), merged)
+        self.last[(symbol, timeframe)] = int(merged['timestamp'][-1])
+
+    # drops the stored bars that start at or after timestamp (epoch ms), the next refresh fetches
+    # them again
+    def truncate(self, symbol, timeframe, timestamp):
+        existing = self.load(symbol, timeframe)
+        keep = existing[existing['timestamp'] < timestamp]
+        if len(keep) == len(existing):
+            return
+        self._save(self._path(symbol, timeframe), np.array(keep))
+        self.last[(symbol, timeframe)] = int(keep['timestamp'][-1]) if len(keep) else None
+
+    def _save(self, path, records):
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp_path, path)
+        return records
+
+    # returns the stored bars for a symbol as a dataframe, optionally from a start time onwards
+    def read(self, symbol, timeframe, _from=None):
+        records = self.load(symbol, timeframe)
+        if _from is not None:
+            start = pd.Timestamp(_from, tz=tz).value // 10**6
+            records = records[records['timestamp'] >= start]
+        return records_to_frame(records)
+
+    # fetches only the bars missing since the last stored bar of each symbol
+    # the last stored bar is fetched again since it may have been incomplete
+    # a symbol whose stored history starts after _from is fetched again from _from
+    # returns the symbols that were refreshed
+    def refresh(self, api, symbols, multiplier, timespan, _from, to, **kwargs):
+        timeframe = timeframe_key(multiplier, timespan)
+        requested = pd.Timestamp(_from, tz=tz).value // 10**6
+        coverage = self.covered_from(timeframe)
+
+        def fetch(symbol):
+            start = self.last_timestamp(symbol, timeframe)
+            backfill = start is None or coverage.get(symbol, requested + 1) > requested
+            df = api.polygon.historic_agg_v2(
+                symbol=symbol, multiplier=multiplier, timespan=timespan,
+                _from=_from if backfill else start, to=to
+            ).df
+            self.write(symbol, timeframe, frame_to_records(df))
+            if backfill:
+                coverage[symbol] = requested
+            return True
+
+        with metrics.timer('history_fetch'):
+            fetched = fetch_all(fetch, symbols, **kwargs)
+            self._save_coverage(timeframe)
+        return [symbol for symbol in symbols if symbol in fetched]
+
+    # refreshes the store and returns the stored history from _from onwards as a dict of dataframes
+    def update(self, api, symbols, multiplier, timespan, _from, to, **kwargs):
+        timeframe = timeframe_key(multiplier, timespan)
+        refreshed = self.refresh(api, symbols, multiplier, timespan, _from, to, **kwargs)
+        return {symbol: self.read(symbol, timeframe, _from) for symbol in refreshed}
@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+import pandas as pd
+
+# compact layout of one bar, converted once when the bars come in from the api
+# timestamps are epoch milliseconds like polygon returns them, prices float32 (7 significant
+# digits) and volumes uint32, so a bar takes 28 bytes instead of the 48 of the float64 frames
+PRICE_DTYPE = np.float32
+VOLUME_DTYPE = np.uint32
+
+BAR_DTYPE = np.dtype([
+    ('timestamp', 'i8'),
+    ('open', PRICE_DTYPE),
+    ('high', PRICE_DTYPE),
+    ('low', PRICE_DTYPE),
+    ('close', PRICE_DTYPE),
+    ('volume', VOLUME_DTYPE),
+])
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
+tz = 'America/New_York'
+
+# minutes per unit of the intraday timespans, the one table the scheduler, the resampler and the
+# synthetic market align their bars with
+TIMESPAN_MINUTES = {'minute': 1, 'hour': 60}
+
+_max_volume = np.iinfo(VOLUME_DTYPE).max
+
+
+# volumes rounded and clipped into the uint32 range (a bar over 4.29 billion shares is clipped)
+def compact_volume(volume):
+    volume = np.asarray(volume, dtype=np.float64)
+    return np.clip(np.nan_to_num(np.round(volume)), 0, _max_volume).astype(VOLUME_DTYPE)
+
+
+# converts a historic_agg_v2 dataframe into an array of bar records
+def frame_to_records(df):
+    records = np.empty(len(df), dtype=BAR_DTYPE)
+    if len(df) == 0:
+        return records
+    records['timestamp'] = df.index.values.astype('datetime64[ms]').astype('i8')
+    for column in PRICE_COLUMNS:
+        records[column] = df[column].values
+    records['volume'] = compact_volume(df['volume'].values)
+    return records
+
+
+# converts an array of bar records back into the dataframe layout the scanners expect
+# the columns keep the compact dtypes, the indicators upcast them where they need to
+def records_to_frame(records):
+    index = pd.to_datetime(records['timestamp'], unit='ms', utc=True).tz_convert(tz)
+    index.name = 'timestamp'
+    return pd.DataFrame({column: records[column] for column in BAR_COLUMNS}, index=index)
+
+
+# the bars of a historic_agg_v2 dataframe in the compact dtypes (the extra polygon columns are dropped)
+def compact_frame(df):
+    return records_to_frame(frame_to_records(df))
+
+
+# interns the symbols as small integer ids, so per-row symbol columns hold a uint32 instead of
+# a python string and the strings are only looked up again when the results are printed
+class SymbolTable:
+
+    def __init__(self, symbols=()):
+        self.ids = {}
+        self.names = []
+        self.lock = threading.Lock()
+        for symbol in symbols:
+            self.id(symbol)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    # the id of a symbol, a new symbol gets the next id
+    def id(self, symbol):
+        i = self.ids.get(symbol)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(symbol)
+                if i is None:
+                    i = self.ids[symbol] = len(self.names)
+                    self.names.append(symbol)
+        return i
+
+    # the ids of many symbols as an array
+    def encode(self, symbols):
+        return np.fromiter((self.id(symbol) for symbol in symbols), dtype=np.uint32, count=len(symbols))
+
+    # the symbols of an array of ids, as an object array
+    def decode(self, ids):
+        return np.array(self.names, dtype=object)[np.asarray(ids, dtype=np.intp)]
+
+
+# the symbol ids shared by the scanners of a process
+symbol_table = SymbolTable()
@@ -0,0 +1,123 @@
+import asyncio
+import re
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+import pandas as pd
+from scheduler import session_close, session_open
+
+
+# local stand-in for the polygon endpoints of tradeapi.REST().polygon
+class MockPolygon:
+
+    def __init__(self, market, latency=0):
+        self.market = market
+        self.latency = latency
+        self.requests = 0
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    # snapshot of every ticker (last trade price and previous day volume)
+    def all_tickers(self):
+        self._request()
+        market = self.market
+        return [
+            SimpleNamespace(ticker=symbol, lastTrade={'p': market.price[i]}, prevDay={'v': market.daily_volume[i]})
+            for i, symbol in enumerate(market.symbols)
+        ]
+
+    def historic_agg_v2(self, symbol, multiplier, timespan, _from, to, **kwargs):
+        self._request()
+        return SimpleNamespace(df=self.market.bars(symbol, multiplier, timespan, _from, to))
+
+
+# local stand-in for tradeapi.REST() serving a synthetic market (see synthetic.py)
+# latency is the seconds every request takes, to account for the network
+class MockREST:
+
+    def __init__(self, market, latency=0):
+        self.market = market
+        self.polygon = MockPolygon(market, latency)
+
+    def list_assets(self, status=None):
+        self.polygon._request()
+        return [SimpleNamespace(symbol=symbol, tradable=bool(tradable))
+                for symbol, tradable in zip(self.market.symbols, self.market.tradable)]
+
+    # every day with the regular session, like the synthetic market
+    def get_calendar(self, start=None, end=None):
+        days = pd.date_range(start, end)
+        return [SimpleNamespace(date=day, open=session_open, close=session_close) for day in days]
+
+
+# local stand-in for tradeapi.StreamConn that plays synthetic AM (minute bar) messages
+# every message is stamped with the time it was sent and the time its handlers took is kept in
+# latencies, the time the first bar of every minute was sent is kept in minute_sent (by bar start)
+# so bar-to-alert latency can be measured
+class MockStreamConn:
+
+    def __init__(self, market, minutes=10):
+        self.market = market
+        self.minutes = minutes
+        self.handlers = []
+        self.symbols = []
+        self.latencies = []
+        self.minute_sent = {}
+        self.sent = 0
+        self.current = None
+
+    def on(self, channel_pat):
+        def register(func):
+            self.handlers.append((re.compile(channel_pat), func))
+            return func
+        return register
+
+    async def subscribe(self, channels):
+        for channel in channels:
+            ev, _, symbol = channel.partition('.')
+            if ev == 'AM' and symbol in self.market.positions:
+                self.symbols.append(symbol)
+
+    async def unsubscribe(self, channels):
+        dropped = {channel.partition('.')[2] for channel in channels}
+        self.symbols = [symbol for symbol in self.symbols if symbol not in dropped]
+
+    async def close(self):
+        pass
+
+    async def _dispatch(self, channel, data):
+        handlers = [func for pattern, func in self.handlers if pattern.match(channel)]
+        self.current = data
+        data.sent = time.perf_counter()
+        for func in handlers:
+            await func(self, channel, data)
+        self.latencies.append(time.perf_counter() - data.sent)
+        self.sent += 1
+
+    # plays the minute bars of the subscribed symbols, minute by minute as fast as they are handled
+    async def play(self, minutes=None):
+        symbols = list(dict.fromkeys(self.symbols))
+        positions = [self.market.positions[symbol] for symbol in symbols]
+        for start, bars in self.market.live_minutes(positions, minutes or self.minutes):
+            columns = {column: values.tolist() for column, values in bars.items()}
+            bar_start, bar_end = start.to_pydatetime(), (start + timedelta(minutes=1)).to_pydatetime()
+            self.minute_sent[bar_start] = time.perf_counter()
+            for j, symbol in enumerate(symbols):
+                data = SimpleNamespace(
+                    symbol=symbol, start=bar_start, end=bar_end,
+                    open=columns['open'][j], high=columns['high'][j], low=columns['low'][j],
+                    close=columns['close'][j], volume=columns['volume'][j],
+                )
+                await self._dispatch('AM', data)
+
+    # subscribes and plays the bars, like StreamConn.run it blocks until the stream ends
+    def run(self, initial_channels=[]):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.subscribe(initial_channels))
+            loop.run_until_complete(self.play())
+        finally:
+            loop.close()
@@ -0,0 +1,494 @@
+# Times the scanners end to end and per stage against a synthetic market served by a local
+# stand-in for the alpaca / polygon apis, so changes can be measured offline.
+#
+#   python -m benchmarks.run --symbols 500 5000 10000 --days 30 --minutes 5
+#
+# For every scenario and universe size it reports the time of each stage, scans/sec and
+# bars/sec (end to end), the peak memory traced while the scenario runs and, for the
+# minute stream, the bar-to-alert latency.
+#
+#   python -m benchmarks.run --symbols 3000 --check
+#
+# runs the equivalence checks instead: the fast paths against the straightforward scans they
+# replaced on the same synthetic bars, a mismatch fails with an AssertionError.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+import engine as scanner_engine
+import fetcher
+from alerts import AlertDispatcher, MemorySink
+from backtest import backtest_crossovers, summarize
+from bar_store import BarStore
+from bars import records_to_frame, tz
+from crossover import scan_crossover_states, scan_crossovers, session_hours
+from engine import ScannerEngine, max_df_rows_in_message
+from fetcher import fetch_history
+from parallel import ParallelStrategy
+from recording import Recorder, RecordingREST, RecordingStream, ReplaySource
+from scheduler import TradingCalendar
+from strategies import CrossoverStrategy, MomentumStrategy, VolumePopStrategy
+from universe import Universe
+from utils import format_alert, paginate
+from benchmarks.mock_api import MockREST, MockStreamConn
+from benchmarks.synthetic import SyntheticMarket
+
+
+# accumulated wall time of the stages of a scenario
+class Stages:
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start
+
+    # times every call of obj.attr as the stage name
+    def wrap(self, obj, attr, name):
+        func = getattr(obj, attr)
+
+        def timed(*args, **kwargs):
+            with self(name):
+                return func(*args, **kwargs)
+        setattr(obj, attr, timed)
+
+
+def _dates(days):
+    now = datetime.now()
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d')
+
+
+# the historical crossover scanner: universe, bar store update, panel scan and alert formatting
+def bench_crossover(api, args, stages, root):
+    strategy = CrossoverStrategy()
+    _from, to = _dates(strategy.lookback.days)
+    with stages('universe'):
+        symbols = Universe(api).filter(**strategy.universe)
+    with stages('fetch'):
+        history = BarStore(root).update(api, symbols, multiplier=60, timespan='minute', _from=_from, to=to)
+    with stages('scan'):
+        results_df = scan_crossovers(history, strategy.sma_fast, strategy.sma_slow,
+                                     strategy.price_change_threshold, symbols)
+    with stages('format'):
+        messages = [format_alert(strategy.title, page.reset_index(), strategy.floatfmt)
+                    for page in paginate(results_df, max_df_rows_in_message)]
+    return {'symbols': len(symbols), 'scans': 1, 'bars': sum(len(df) for df in history.values()),
+            'alerts': len(results_df), 'messages': len(messages)}
+
+
+# the end of day volume pop scan: the daily bars of the universe into the store, then one panel pass
+def bench_volume_pop(api, args, stages, root):
+    strategy = VolumePopStrategy()
+    store = BarStore(root)
+    _from, to = _dates(strategy.lookback.days)
+    with stages('universe'):
+        symbols = Universe(api).filter(**strategy.universe)
+    with stages('fetch'):
+        symbols = store.refresh(api, symbols, multiplier=1, timespan='day', _from=_from, to=to)
+    with stages('load'):
+        bars = {symbol: store.load(symbol, strategy.timeframe) for symbol in symbols}
+    with stages('scan'):
+        for _ in range(args.repeat):
+            results_df = strategy.scan(bars, symbols)
+    with stages('format'):
+        messages = [format_alert(strategy.title, page, strategy.floatfmt)
+                    for page in paginate(results_df, max_df_rows_in_message)]
+    return {'symbols': len(symbols), 'scans': args.repeat, 'bars': args.repeat * sum(len(bars[s]) for s in symbols),
+            'alerts': len(results_df), 'messages': len(messages)}
+
+
+# the engine's scheduled crossover scan: a cold scan then warm scans that only fetch the newest bars
+def bench_crossover_engine(api, args, stages, root):
+    alerts = AlertDispatcher(MemorySink(), window=0, echo=False)
+    engine = ScannerEngine(api, alerts, bar_store=BarStore(root), calendar=TradingCalendar(api))
+    strategy = engine.add(CrossoverStrategy())
+    counts = {'bars': 0, 'alerts': 0}
+    scan = strategy.scan
+
+    def counted_scan(bars, symbols):
+        counts['bars'] += sum(len(bars[symbol]) for symbol in symbols)
+        results_df = scan(bars, symbols)
+        counts['alerts'] += len(results_df)
+        return results_df
+    strategy.scan = counted_scan
+    stages.wrap(engine.bar_store, 'refresh', 'refresh')
+    stages.wrap(strategy, 'scan', 'scan')
+    stages.wrap(engine, 'publish', 'publish')
+
+    async def run():
+        with stages('cold'):
+            await engine.run_once()
+        with stages('warm'):
+            for _ in range(args.repeat):
+                await engine.run_once()
+        await alerts.flush()
+    asyncio.run(run())
+    return {'symbols': len(strategy.states), 'scans': 1 + args.repeat, 'bars': counts['bars'],
+            'alerts': counts['alerts'], 'messages': alerts.sink.sent}
+
+
+# the 1 minute momentum stream: minute history, seeding and the AM bars played through the handler
+# the alert latency is taken from the first bar of the alert's minute, so it includes the wait
+# behind the rest of the burst of bars on the minute
+def bench_momentum(api, args, stages, root, parallel=False):
+    alerts = AlertDispatcher(MemorySink(), window=0, echo=False)
+    engine = ScannerEngine(api, alerts, bar_store=BarStore(root), calendar=TradingCalendar(api))
+    strategy = MomentumStrategy()
+    if parallel:
+        strategy = ParallelStrategy(strategy, args.workers)
+    engine.add(strategy)
+    conn = MockStreamConn(api.market, args.minutes)
+    stages.wrap(strategy, 'seed', 'seed')
+
+    alert_latencies = []
+    submit = alerts.submit
+
+    def timed_submit(message, event_time=None, *args):
+        alert_latencies.append(time.perf_counter() - conn.minute_sent[event_time])
+        submit(message, event_time, *args)
+    alerts.submit = timed_submit
+
+    async def run():
+        with stages('start'):
+            await engine.start_stream(conn)
+        with stages('stream'):
+            await conn.play()
+            engine.flush_minute_bars()
+            if parallel:
+                await strategy.stop()
+                # the last alerts are forwarded on the next turns of the loop
+                await asyncio.sleep(0.1)
+        await alerts.flush()
+    asyncio.run(run())
+    return {'symbols': len(conn.symbols), 'scans': conn.sent, 'bars': conn.sent, 'alerts': len(alert_latencies),
+            'messages': alerts.sink.sent, 'latencies': conn.latencies, 'alert_latencies': alert_latencies}
+
+
+# the multi-core backtest over the stored hourly bars of the last days
+def bench_backtest(api, args, stages, root):
+    strategy = CrossoverStrategy()
+    _from, to = _dates(args.days)
+    store = BarStore(root)
+    with stages('universe'):
+        symbols = Universe(api).filter(**strategy.universe)
+    with stages('store'):
+        symbols = store.refresh(api, symbols, multiplier=60, timespan='minute', _from=_from, to=to)
+    with stages('backtest'):
+        signals = backtest_crossovers(symbols, _from=_from, store=store, workers=args.workers)
+    with stages('summarize'):
+        summarize(signals)
+    bars = sum(len(store.load(symbol, strategy.timeframe)) for symbol in symbols)
+    return {'symbols': len(symbols), 'scans': 1, 'bars': bars, 'alerts': len(signals), 'messages': 0}
+
+
+def bench_momentum_parallel(api, args, stages, root):
+    return bench_momentum(api, args, stages, root, parallel=True)
+
+
+# the momentum stream with every bar evaluated on its own dataframe as it comes in
+def bench_momentum_per_bar(api, args, stages, root):
+    batch_seconds = scanner_engine.minute_batch_seconds
+    scanner_engine.minute_batch_seconds = None
+    try:
+        return bench_momentum(api, args, stages, root)
+    finally:
+        scanner_engine.minute_batch_seconds = batch_seconds
+
+
+# records the momentum stream (rest responses and AM bars) and replays the recording through a new
+# engine as fast as it goes, the replay has to raise the same alerts as the recorded run
+def bench_replay(api, args, stages, root):
+    path = os.path.join(root, 'recording.jsonl.gz')
+    recorder = Recorder(path)
+    recorded = AlertDispatcher(MemorySink(), window=0, echo=False)
+    engine = ScannerEngine(RecordingREST(api, recorder), recorded, bar_store=BarStore(root),
+                           calendar=TradingCalendar(api))
+    engine.add(MomentumStrategy())
+    conn = MockStreamConn(api.market, args.minutes)
+
+    async def record():
+        with stages('record'):
+            await engine.start_stream(RecordingStream(conn, recorder))
+            await conn.play()
+            engine.flush_minute_bars()
+        await recorded.flush()
+    asyncio.run(record())
+    recorder.close()
+
+    with stages('load'):
+        source = ReplaySource(path)
+    replayed = AlertDispatcher(MemorySink(), window=0, echo=False)
+    engine = ScannerEngine(source.rest, replayed, bar_store=BarStore(root), calendar=TradingCalendar(source.rest))
+    engine.add(MomentumStrategy())
+
+    async def replay():
+        with stages('replay'):
+            await engine.start_stream(source.stream_conn())
+            await source.wait()
+            engine.flush_minute_bars()
+        await replayed.flush()
+    asyncio.run(replay())
+    if replayed.sink.messages != recorded.sink.messages or replayed.sink.sent != recorded.sink.sent:
+        print('replay raised {} alerts, the recorded run {}'.format(replayed.sink.sent, recorded.sink.sent))
+    replayed_bars = sum(stream.sent for stream in source.streams)
+    return {'symbols': len(conn.symbols), 'scans': replayed_bars, 'bars': replayed_bars,
+            'alerts': replayed.sink.sent, 'messages': replayed.sink.sent}
+
+
+scenarios = {
+    'crossover': bench_crossover,
+    'crossover_engine': bench_crossover_engine,
+    'volume_pop': bench_volume_pop,
+    'momentum': bench_momentum,
+    'momentum_parallel': bench_momentum_parallel,
+    'momentum_per_bar': bench_momentum_per_bar,
+    'backtest': bench_backtest,
+    'replay': bench_replay,
+}
+
+
+# the per-symbol pandas / talib crossover scan the panel scan replaced: the latest bar of every
+# symbol on its own dataframe, in the layout of scan_crossovers
+def _reference_crossovers(history, sma_fast, sma_slow, price_change_threshold, symbols):
+    import talib as ta
+    rows = []
+    for symbol in symbols:
+        df = history[symbol].copy()
+        df = df[(df.index.hour >= 9) & (df.index.hour < 16)]
+        df['fast_sma'] = df['close'].rolling(window=sma_fast).mean()
+        df['slow_sma'] = df['close'].rolling(window=sma_slow).mean()
+        df['prev_fast_sma'] = df['fast_sma'].shift()
+        df['prev_slow_sma'] = df['slow_sma'].shift()
+        df['symbol'] = symbol
+        df['price_change'] = df['close'] - df['close'].shift()
+        df['perc_change'] = df['price_change'] / df['close'].shift() * 100
+        df['rsi'] = ta.RSI(np.array(df['close'], dtype=float))
+        df.index = df.index.strftime("%x %I %p")
+        df = df.tail(1)
+        up = (df['fast_sma'] > df['slow_sma']) & (df['prev_fast_sma'] < df['prev_slow_sma'])
+        down = (df['fast_sma'] < df['slow_sma']) & (df['prev_fast_sma'] > df['prev_slow_sma'])
+        df = df[(up | down) & (df['price_change'].abs() > price_change_threshold)].copy()
+        df['dir'] = np.where(up[df.index], 'Up', 'Down')
+        rows.append(df[['symbol', 'dir', 'price_change', 'perc_change', 'volume', 'rsi']])
+    return pd.concat(rows) if rows else pd.DataFrame()
+
+
+def _assert_same_alerts(name, expected, actual):
+    expected = expected.reset_index().sort_values('symbol', kind='stable').reset_index(drop=True)
+    actual = actual.reset_index().sort_values('symbol', kind='stable').reset_index(drop=True)
+    assert len(expected) == len(actual), '{}: {} alerts expected, {} raised'.format(name, len(expected), len(actual))
+    for column in expected.columns:
+        if not pd.api.types.is_numeric_dtype(expected[column]):
+            same = (expected[column].astype(str).values == actual[column].astype(str).values).all()
+        else:
+            same = np.allclose(expected[column].astype(float), actual[column].astype(float), rtol=1e-5, equal_nan=True)
+        assert same, '{}: column {} differs\n{}\n{}'.format(name, column, expected, actual)
+
+
+# the panel crossover scan against the per-symbol scan, on the latest bar of every cutoff of the
+# last args.minutes hourly bars
+def check_crossover(api, args, root):
+    strategy = CrossoverStrategy()
+    _from, to = _dates(strategy.lookback.days)
+    symbols = Universe(api).filter(**strategy.universe)
+    history = fetch_history(api, symbols, multiplier=60, timespan='minute', _from=_from, to=to)
+    symbols = [symbol for symbol in symbols if symbol in history and len(history[symbol])]
+    cutoffs = sorted({time for df in history.values() for time in df.index})[-args.minutes:]
+    alerts = 0
+    for cutoff in cutoffs:
+        cut = {symbol: history[symbol][history[symbol].index <= cutoff] for symbol in symbols}
+        expected = _reference_crossovers(cut, strategy.sma_fast, strategy.sma_slow,
+                                         strategy.price_change_threshold, symbols)
+        actual = scan_crossovers(cut, strategy.sma_fast, strategy.sma_slow, strategy.price_change_threshold, symbols)
+        _assert_same_alerts('crossover at {}'.format(cutoff), expected, actual)
+        alerts += len(actual)
+    return {'symbols': len(symbols), 'runs': len(cutoffs), 'alerts': alerts}
+
+
+# the crossover states kept between scans against a full panel scan of the same bars, the states
+# are fed one more in-session hourly bar per run over the last args.minutes of them
+def check_crossover_states(api, args, root):
+    strategy = CrossoverStrategy()
+    # the history reaches back far enough for the runs to start after a full lookback (7 session
+    # bars a day on the synthetic market)
+    _from, to = _dates(strategy.lookback.days + args.minutes // 7)
+    store = BarStore(root)
+    symbols = Universe(api).filter(**strategy.universe)
+    symbols = store.refresh(api, symbols, multiplier=60, timespan='minute', _from=_from, to=to)
+    records = {symbol: store.load(symbol, strategy.timeframe) for symbol in symbols}
+    times = np.unique(np.concatenate([bars['timestamp'] for bars in records.values()]))
+    hours = pd.to_datetime(times, unit='ms', utc=True).tz_convert(tz).hour
+    cutoffs = times[(hours >= session_hours[0]) & (hours < session_hours[1])][-args.minutes:]
+    states = {}
+    alerts = 0
+    for cutoff in cutoffs:
+        bars = {symbol: records[symbol][records[symbol]['timestamp'] <= cutoff] for symbol in symbols}
+        expected = scan_crossovers({symbol: records_to_frame(bars[symbol]) for symbol in symbols}, strategy.sma_fast,
+                                   strategy.sma_slow, strategy.price_change_threshold, symbols)
+        actual = scan_crossover_states(states, bars, strategy.sma_fast, strategy.sma_slow,
+                                       strategy.price_change_threshold, _from, symbols)
+        _assert_same_alerts('crossover states at {}'.format(pd.Timestamp(cutoff, unit='ms', tz='UTC').tz_convert(tz)), expected, actual)
+        alerts += len(actual)
+    return {'symbols': len(symbols), 'runs': len(cutoffs), 'alerts': alerts}
+
+
+# the momentum strategy's batches (on_minute_bars, one per minute) against every bar evaluated on
+# its own dataframe (on_minute_bar), over args.minutes of streamed minute bars
+def check_momentum_batches(api, args, root):
+    single, batched = MomentumStrategy(), MomentumStrategy()
+    symbols = Universe(api).filter(**single.universe)
+    history = fetch_history(api, symbols, multiplier=1, timespan='minute', _from=single.history_from(),
+                            to=datetime.now().strftime('%Y-%m-%d'))
+    for strategy in (single, batched):
+        strategy.seed({symbol: df.copy() for symbol, df in history.items()})
+    conn = MockStreamConn(api.market, args.minutes)
+    expected, actual, minute = [], [], []
+
+    def flush():
+        actual.extend(key for alert_df, _ in batched.on_minute_bars(minute) for key in batched.alert_keys(alert_df))
+        minute.clear()
+
+    @conn.on(r'AM$')
+    async def handle_minute_bar(conn, channel, data):
+        if minute and data.start > minute[0].start:
+            flush()
+        minute.append(data)
+        alert_df = single.on_minute_bar(data)
+        if alert_df is not None:
+            expected.extend(single.alert_keys(alert_df))
+
+    asyncio.run(conn.subscribe(['AM.{}'.format(symbol) for symbol in history]))
+    asyncio.run(conn.play())
+    flush()
+    assert sorted(map(repr, expected)) == sorted(map(repr, actual)), \
+        'momentum batches: {} alerts expected, {} raised\n{}\n{}'.format(len(expected), len(actual), expected, actual)
+    return {'symbols': len(history), 'runs': args.minutes, 'alerts': len(actual)}
+
+
+checks = {
+    'crossover': check_crossover,
+    'crossover_states': check_crossover_states,
+    'momentum_batches': check_momentum_batches,
+}
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if len(values) else None
+
+
+# runs a scenario once for the timings and, unless disabled, once more under tracemalloc for the peak memory
+def run_scenario(name, market, args):
+    api = MockREST(market, args.latency)
+    stages = Stages()
+    quiet = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        result = scenarios[name](api, args, stages, root)
+        total = time.perf_counter() - start
+
+    peak = None
+    if args.memory:
+        with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(quiet):
+            tracemalloc.start()
+            try:
+                scenarios[name](MockREST(market, args.latency), args, Stages(), root)
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+            finally:
+                tracemalloc.stop()
+
+    row = {
+        'scenario': name,
+        'universe': len(market.symbols),
+        'symbols': result['symbols'],
+        'seconds': total,
+        'scans/sec': result['scans'] / total,
+        'bars/sec': result['bars'] / total,
+        'alerts': result['alerts'],
+        'messages': result['messages'],
+        'peak MB': peak,
+        'stages': {stage: seconds for stage, seconds in stages.seconds.items()},
+    }
+    if 'latencies' in result:
+        row['bar p50 ms'] = _percentile(result['latencies'], 50)
+        row['bar p99 ms'] = _percentile(result['latencies'], 99)
+        row['alert p50 ms'] = _percentile(result['alert_latencies'], 50)
+        row['alert max ms'] = _percentile(result['alert_latencies'], 100)
+    return row
+
+
+# runs the equivalence checks on every universe size, the first mismatch raises
+def run_checks(args):
+    rows = []
+    for n_symbols in args.symbols:
+        market = SyntheticMarket(n_symbols, days=max(args.days, 8), seed=args.seed, spike_rate=args.spike_rate)
+        for name in args.check or checks:
+            quiet = open(os.devnull, 'w') if not args.verbose else sys.stdout
+            with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(quiet):
+                result = checks[name](MockREST(market, args.latency), args, root)
+            rows.append(dict({'check': name, 'universe': n_symbols}, **result))
+            print('{} x {}: ok'.format(name, n_symbols))
+    print(tabulate(rows, headers='keys', tablefmt='github', missingval='-'))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the scanners against a synthetic market')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[500], help='universe sizes to run')
+    parser.add_argument('--scenarios', nargs='+', default=list(scenarios), choices=list(scenarios))
+    parser.add_argument('--days', type=int, default=30, help='days of history the backtest runs over')
+    parser.add_argument('--minutes', type=int, default=5, help='minutes of AM bars streamed')
+    parser.add_argument('--repeat', type=int, default=3, help='warm scans after the cold one')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every api request takes')
+    parser.add_argument('--rate', type=float, default=1e6, help='api requests per second allowed')
+    parser.add_argument('--workers', type=int, default=None, help='backtest and stream worker processes')
+    parser.add_argument('--spike-rate', type=float, default=.01, help='chance of a bar jumping on volume')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the traced memory run')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the scanners\' own output')
+    parser.add_argument('--check', nargs='*', choices=list(checks),
+                        help='run these equivalence checks (all without names) instead of the timings')
+    args = parser.parse_args(argv)
+
+    fetcher.requests_per_second = args.rate
+
+    if args.check is not None:
+        return run_checks(args)
+
+    rows = []
+    for n_symbols in args.symbols:
+        market = SyntheticMarket(n_symbols, days=max(args.days, 8), seed=args.seed, spike_rate=args.spike_rate)
+        for name in args.scenarios:
+            row = run_scenario(name, market, args)
+            rows.append(row)
+            stages = ', '.join('{} {:.3f}s'.format(stage, seconds) for stage, seconds in row['stages'].items())
+            print('{} x {}: {:.3f}s ({})'.format(name, n_symbols, row['seconds'], stages))
+
+    table = [{key: value for key, value in row.items() if key != 'stages'} for row in rows]
+    print(tabulate(table, headers='keys', tablefmt='github', floatfmt=',.2f', missingval='-'))
+    print('max rss {:.0f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import zlib
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from bar_store import BAR_COLUMNS, timeframe_key, tz
+from bars import TIMESPAN_MINUTES
+
+# hours (ny time) polygon has intraday aggregates for, pre and post market included
+extended_hours = (4, 20)
+
+# minutes in the extended session, used to scale the daily volatility and volume to a bar
+_session_minutes = (extended_hours[1] - extended_hours[0]) * 60
+
+
+# returns n distinct ticker-like symbols ('A', 'B', ... 'AA', 'AB', ...)
+def make_symbols(n):
+    symbols = []
+    length, count = 1, 26
+    while len(symbols) < n:
+        for i in range(min(count, n - len(symbols))):
+            symbol = ''
+            for _ in range(length):
+                i, letter = divmod(i, 26)
+                symbol = chr(ord('A') + letter) + symbol
+            symbols.append(symbol)
+        length += 1
+        count *= 26
+    return symbols
+
+
+# a deterministic market of random walk OHLCV bars for any timeframe
+# every symbol walks backwards from its current price at end, so the bars of a symbol are the
+# same whatever range they are requested for and the live bars carry on from the history
+class SyntheticMarket:
+
+    # spike_rate is the chance of a bar jumping spike_size (as a fraction) on spike_volume times the volume
+    def __init__(self, n_symbols, days=30, end=None, seed=0, tradable_share=.95,
+                 spike_rate=.0005, spike_size=.06, spike_volume=20):
+        self.symbols = make_symbols(n_symbols)
+        self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.seed = seed
+        self.end = pd.Timestamp(end, tz=tz) if end is not None else pd.Timestamp.now(tz).floor('min')
+        self.start = (self.end - timedelta(days=days)).normalize()
+        self.spike_rate = spike_rate
+        self.spike_size = spike_size
+        self.spike_volume = spike_volume
+
+        rng = np.random.default_rng([seed, n_symbols])
+        self.price = np.exp(rng.uniform(np.log(.5), np.log(500), n_symbols))
+        self.daily_volume = np.exp(rng.uniform(np.log(5e4), np.log(5e7), n_symbols))
+        self.volatility = rng.uniform(.01, .05, n_symbols)
+        self.tradable = rng.random(n_symbols) < tradable_share
+        self.timelines = {}
+
+    # epoch ms start times of every bar of the timeframe from start to end
+    def timeline(self, multiplier, timespan):
+        key = timeframe_key(multiplier, timespan)
+        if key not in self.timelines:
+            # every day trades, so a benchmark has bars for today whatever day it runs on
+            days = pd.date_range(self.start.tz_localize(None), self.end.tz_localize(None).normalize())
+            if timespan == 'day':
+                starts = days
+            else:
+                step = multiplier * TIMESPAN_MINUTES[timespan]
+                offsets = np.arange(extended_hours[0] * 60, extended_hours[1] * 60, step) * 60 * 10**9
+                starts = pd.DatetimeIndex((days.values[:, None] + offsets.astype('timedelta64[ns]')).ravel())
+            times = starts.tz_localize(tz).as_unit('ms').asi8
+            self.timelines[key] = times[times <= self.end.value // 10**6]
+        return self.timelines[key]
+
+    def _generator(self, symbol, key, stream):
+        return np.random.default_rng([self.seed, self.positions[symbol], zlib.crc32(key.encode()), stream])
+
+    # the float64 bar records (the fields of polygon's aggregates) of a symbol from _from to the end of the day to
+    # _from and to are dates, _from can also be epoch ms like the bar store asks for after its last bar
+    def records(self, symbol, multiplier, timespan, _from, to=None):
+        times = self.timeline(multiplier, timespan)
+        if isinstance(_from, (int, np.integer)):
+            start = int(_from)
+        else:
+            start = pd.Timestamp(_from, tz=tz).value // 10**6
+        stop = len(times)
+        if to is not None:
+            stop = np.searchsorted(times, (pd.Timestamp(to, tz=tz) + timedelta(days=1)).value // 10**6)
+        first = np.searchsorted(times, start)
+
+        # draws run backwards from the last bar, so a longer range only adds draws at the end
+        key = timeframe_key(multiplier, timespan)
+        count = len(times) - first + 1
+        i = self.positions[symbol]
+        minutes = _session_minutes if timespan == 'day' else multiplier * TIMESPAN_MINUTES[timespan]
+        scale = np.sqrt(minutes / _session_minutes)
+        returns = self._generator(symbol, key, 0).standard_normal(count) * self.volatility[i] * scale
+        spikes = self._generator(symbol, key, 1).random(count) < self.spike_rate
+        returns[spikes] += self.spike_size
+        # close of the bar before the first one and then every bar, oldest first
+        closes = self.price[i] * np.exp(-np.concatenate([[0], np.cumsum(returns[:-1])]))[::-1]
+        wicks = np.abs(self._generator(symbol, key, 2).standard_normal((count, 2))) * self.volatility[i] * scale / 2
+        wicks = wicks[::-1].T
+        volume = self._generator(symbol, key, 3).lognormal(0, .5, count) * self.daily_volume[i] * minutes / _session_minutes
+        volume[spikes] *= self.spike_volume
+
+        open_, close = closes[:-1], closes[1:]
+        records = np.zeros(stop - first, dtype=[('timestamp', 'i8')] + [(c, 'f8') for c in BAR_COLUMNS])
+        n = len(records)
+        records['timestamp'] = times[first:stop]
+        records['open'] = open_[:n]
+        records['close'] = close[:n]
+        records['high'] = np.maximum(open_, close)[:n] * (1 + wicks[0, 1:1 + n])
+        records['low'] = np.minimum(open_, close)[:n] * (1 - wicks[1, 1:1 + n])
+        records['volume'] = np.round(volume[::-1][1:1 + n])
+        return records
+
+    # the bars of a symbol as a dataframe shaped like polygon's historic_agg_v2(...).df
+    def bars(self, symbol, multiplier, timespan, _from, to=None):
+        records = self.records(symbol, multiplier, timespan, _from, to)
+        index = pd.to_datetime(records['timestamp'], unit='ms', utc=True).tz_convert(tz)
+        index.name = 'timestamp'
+        return pd.DataFrame({column: records[column] for column in BAR_COLUMNS}, index=index)
+
+    # minute bars after end for the positions given, one dict of arrays per minute
+    # the walk carries on from each symbol's current price
+    def live_minutes(self, positions, minutes, seed=None):
+        positions = np.asarray(positions)
+        rng = np.random.default_rng([self.seed if seed is None else seed, len(positions), minutes])
+        scale = np.sqrt(1 / _session_minutes)
+        close = self.price[positions].copy()
+        volume = self.daily_volume[positions] / _session_minutes
+        volatility = self.volatility[positions] * scale
+        for minute in range(1, minutes + 1):
+            returns = rng.standard_normal(len(positions)) * volatility
+            spikes = rng.random(len(positions)) < self.spike_rate
+            returns[spikes] += self.spike_size
+            open_ = close
+            close = open_ * np.exp(returns)
+            wicks = np.abs(rng.standard_normal((2, len(positions)))) * volatility / 2
+            bar_volume = np.round(rng.lognormal(0, .5, len(positions)) * volume)
+            bar_volume[spikes] *= self.spike_volume
+            yield self.end + timedelta(minutes=minute), {
+                'open': open_, 'close': close, 'volume': bar_volume,
+                'high': np.maximum(open_, close) * (1 + wicks[0]),
+                'low': np.minimum(open_, close) * (1 - wicks[1]),
+            }
@@ -0,0 +1,102 @@
+import os
+
+# the api and discord clients, created on first use and shared by everything in the process
+# so importing a scanner module neither imports the client libraries nor connects anywhere
+
+# channel the alerts go to when DISCORD_CHANNEL is not set
+default_channel_id = 721931969138786364
+
+# recording every rest response and stream message of the run is appended to (see recording.py)
+record_path = os.getenv('SCANNER_RECORD')
+
+# recording the rest and stream clients are served from instead of the api, and its speed
+# (1 real time, 10 ten times faster, None as fast as the scanners go)
+replay_path = os.getenv('SCANNER_REPLAY')
+replay_speed = None
+
+_clients = {}
+
+
+def _load_env():
+    if 'env' not in _clients:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _clients['env'] = True
+
+
+def replay_source():
+    if 'replay' not in _clients:
+        from recording import ReplaySource
+        _clients['replay'] = ReplaySource(replay_path, replay_speed)
+    return _clients['replay']
+
+
+def recorder():
+    if 'recorder' not in _clients:
+        from recording import Recorder
+        _clients['recorder'] = Recorder(record_path)
+    return _clients['recorder']
+
+
+# the alpaca rest client (its polygon client included)
+def rest():
+    if 'rest' not in _clients:
+        if replay_path:
+            _clients['rest'] = replay_source().rest
+        else:
+            _load_env()
+            import alpaca_trade_api as tradeapi
+            api = tradeapi.REST()
+            if record_path:
+                from recording import RecordingREST
+                api = RecordingREST(api, recorder())
+            _clients['rest'] = api
+    return _clients['rest']
+
+
+# a new alpaca / polygon streaming connection, every call opens its own
+def stream_conn():
+    if replay_path:
+        return replay_source().stream_conn()
+    _load_env()
+    import alpaca_trade_api as tradeapi
+    conn = tradeapi.StreamConn()
+    if record_path:
+        from recording import RecordingStream
+        conn = RecordingStream(conn, recorder())
+    return conn
+
+
+def discord_client():
+    if 'discord' not in _clients:
+        _load_env()
+        import discord
+        _clients['discord'] = discord.Client()
+    return _clients['discord']
+
+
+# flushes and closes the recording, if there is one
+def close():
+    if 'recorder' in _clients:
+        _clients.pop('recorder').close()
+
+
+def discord_token():
+    _load_env()
+    return os.getenv('DISCORD_TOKEN')
+
+
+def discord_channel_id():
+    _load_env()
+    channel = os.getenv('DISCORD_CHANNEL')
+    return int(channel) if channel else default_channel_id
+
+
+# applies the METRICS_PORT / METRICS_LOG_INTERVAL settings of the environment to metrics
+def configure_metrics():
+    _load_env()
+    import metrics
+    port = os.getenv('METRICS_PORT')
+    interval = os.getenv('METRICS_LOG_INTERVAL')
+    metrics.metrics_port = int(port) if port else None
+    metrics.log_interval = float(interval) if interval else None
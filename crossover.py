@@ -0,0 +1,135 @@
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pytz import timezone
+from bars import VOLUME_DTYPE, symbol_table
+from indicators import CrossoverState
+from panel import build_panel, shift, rolling_mean, rsi, tz
+from results import ResultCollector
+import metrics
+
+# columns of the crossover alert table
+RESULT_COLUMNS = ['symbol', 'dir', 'price_change', 'perc_change', 'volume', 'rsi']
+
+# dtypes of the non float columns of the alert rows, the rows hold epoch ms, symbol ids and
+# +1 / -1 for the direction until they are formatted for output (see RESULT_FORMATS)
+RESULT_DTYPES = {'timestamp': np.int64, 'symbol': np.uint32, 'dir': np.int8, 'volume': VOLUME_DTYPE}
+
+# regular trading hours used when scanning hourly bars
+session_hours = (9, 16)
+
+nyc = timezone(tz)
+
+
+# the epoch ms bar times of the alert rows as the hourly labels of the alert table
+def _bar_labels(timestamps):
+    return pd.to_datetime(timestamps, unit='ms', utc=True).tz_convert(tz).strftime("%x %I %p")
+
+
+def _directions(dirs):
+    return np.where(dirs > 0, 'Up', 'Down').astype(object)
+
+
+# turns the compact alert rows into the strings shown in the alert table
+RESULT_FORMATS = {'timestamp': _bar_labels, 'symbol': symbol_table.decode, 'dir': _directions}
+
+
+# computes the 13/30 crossover indicators for every symbol and bar of the panel at once
+def compute_crossovers(panel, sma_fast, sma_slow, rsi_period=14):
+    close = panel['close']
+    fast_sma = rolling_mean(close, sma_fast)
+    slow_sma = rolling_mean(close, sma_slow)
+    prev_close = shift(close)
+    prev_fast_sma = shift(fast_sma)
+    prev_slow_sma = shift(slow_sma)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        price_change = close - prev_close
+        perc_change = (price_change / prev_close) * 100
+
+    return {
+        'fast_sma': fast_sma,
+        'slow_sma': slow_sma,
+        'price_change': price_change,
+        'perc_change': perc_change,
+        'rsi': rsi(close, rsi_period),
+        'up': (fast_sma > slow_sma) & (prev_fast_sma < prev_slow_sma),
+        'down': (fast_sma < slow_sma) & (prev_fast_sma > prev_slow_sma),
+    }
+
+
+# scans the latest bar of every symbol for a 13/30 cross with a price change over the threshold
+# returns the alert rows indexed by the bar time, in the same layout as the per-symbol scan had
+def scan_crossovers(history, sma_fast, sma_slow, price_change_threshold, symbols=None):
+    panel = build_panel(history, symbols, session_hours=session_hours)
+    if panel.shape[1] == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    with metrics.timer('indicators'):
+        indicators = compute_crossovers(panel, sma_fast, sma_slow)
+    metrics.inc('scanner_bars_processed_total', int(np.count_nonzero(~np.isnan(panel['close']))), scan='crossover')
+    metrics.inc('scanner_symbols_skipped_total', len(symbols or history) - panel.shape[0], reason='no history')
+    last = panel.shape[1] - 1
+
+    with metrics.timer('filter'):
+        up = indicators['up'][:, last]
+        down = indicators['down'][:, last]
+        price_change = indicators['price_change'][:, last]
+        rows = np.flatnonzero((up | down) & (np.abs(price_change) > price_change_threshold))
+
+    index = panel.times(rows, last).strftime("%x %I %p")
+    index.name = 'timestamp'
+    return pd.DataFrame({
+        'symbol': np.array(panel.symbols, dtype=object)[rows],
+        'dir': np.where(up[rows], 'Up', 'Down'),
+        'price_change': price_change[rows],
+        'perc_change': indicators['perc_change'][rows, last],
+        'volume': panel['volume'][rows, last],
+        'rsi': indicators['rsi'][rows, last],
+    }, index=index, columns=RESULT_COLUMNS)
+
+
+# feeds the bars stored since each state's last update into the per-symbol crossover states
+# and returns the alert rows for the latest bar, in the same layout as scan_crossovers
+# bars is a dict of bar record arrays (see bar_store), a new symbol is seeded from _from onwards
+def scan_crossover_states(states, bars, sma_fast, sma_slow, price_change_threshold, _from, symbols=None):
+    start_ms = pd.Timestamp(_from, tz=tz).value // 10**6
+    results = ResultCollector(RESULT_COLUMNS, 'timestamp', RESULT_DTYPES, formats=RESULT_FORMATS)
+    processed = skipped = 0
+    started = time.perf_counter()
+    for symbol in (symbols or bars):
+        if symbol not in bars:
+            skipped += 1
+            continue
+        records = bars[symbol]
+        timestamps = records['timestamp']
+
+        state = states.get(symbol)
+        if state is None:
+            state = states[symbol] = CrossoverState(sma_fast, sma_slow)
+        start = np.searchsorted(timestamps, max(start_ms, state.last_timestamp or 0))
+        processed += int(len(timestamps) - start)
+
+        updated = False
+        for timestamp, close, volume in zip(timestamps[start:].tolist(),
+                                            records['close'][start:].tolist(),
+                                            records['volume'][start:].tolist()):
+            hour = datetime.fromtimestamp(timestamp / 1000, nyc).hour
+            if hour < session_hours[0] or hour >= session_hours[1]:
+                continue
+            state.update(timestamp, close, volume)
+            updated = True
+
+        # only a symbol with a new (or revised) bar can have a new cross
+        direction = state.cross() if updated else None
+        if direction is None or not abs(state.price_change) > price_change_threshold:
+            continue
+        results.add(state.last_timestamp, symbol_table.id(symbol), 1 if direction == 'Up' else -1,
+                    state.price_change, state.perc_change, state.volume, state.rsi)
+
+    metrics.observe('scanner_stage_seconds', time.perf_counter() - started, stage='indicators')
+    metrics.inc('scanner_bars_processed_total', processed, scan='crossover')
+    metrics.inc('scanner_symbols_skipped_total', skipped, reason='no history')
+
+    return results.frame()
@@ -0,0 +1,316 @@
+import asyncio
+from datetime import datetime
+from functools import partial
+from alerts import AlertState
+from bar_store import BarStore, timeframe_key
+from fetcher import fetch_history
+from resampler import Resampler
+from scheduler import BarCloseScheduler, TradingCalendar
+from universe import Universe
+from utils import format_alert, paginate
+import metrics
+import sharding
+
+# maximum rows of an alert table in one message
+max_df_rows_in_message = 10
+
+# seconds to wait after a bar closes before scanning it, so the bar is complete at polygon
+bar_settle_seconds = 60
+
+# builds the bars of the bar strategies from the minute stream instead of asking the api for them
+# on every bar close, the api is only asked for the history before the stream started
+resample_bars = True
+
+# seconds to wait after a bar closes before scanning the bars built from the stream, the time it
+# takes the last minute bar of the bar to come in
+resampled_settle_seconds = 5
+
+# seconds the minute bars are collected for from the first bar of a minute before the strategies
+# that take batches (on_minute_bars) evaluate them together, None evaluates every bar as it comes in
+minute_batch_seconds = 1.0
+
+
+# one scanner process for all the strategies (see strategies.py)
+# the universe, the bar store and the minute stream are shared, so symbols scanned by several
+# strategies are fetched once and held in memory once
+class ScannerEngine:
+
+    # alerts is the AlertDispatcher the alert messages are queued on, alert_state the AlertState
+    # repeats of the strategies with alert_keys are dropped by
+    # symbols limits every strategy to those symbols, ex. one shard of them in a shard process
+    def __init__(self, api, alerts, universe=None, bar_store=None, calendar=None, settle_seconds=None,
+                 alert_state=None, symbols=None):
+        self.api = api
+        self.symbols = None if symbols is None else set(symbols)
+        self.alerts = alerts
+        self.alert_state = alert_state or AlertState()
+        self.settle_seconds = bar_settle_seconds if settle_seconds is None else settle_seconds
+        self.universe = universe or Universe(api)
+        self.bar_store = bar_store or BarStore()
+        self.scheduler = BarCloseScheduler(calendar or TradingCalendar(api))
+        self.strategies = []
+        self.started = False
+        # the resamplers of the timeframes built from the minute stream, the symbols whose stored
+        # bars have been refreshed since their resampler started, by timeframe, and the symbols
+        # subscribed to the minute stream (only their bars can be built from it)
+        self.resamplers = {}
+        self.resampled = {}
+        self.stream_symbols = set()
+        # the minute bars waiting for the batch evaluation, the start of the minute they are on
+        self.minute_batch = []
+        self.batch_minute = None
+        self.batch_timer = None
+        self.batched = []
+        # minute bars by symbol a warm start seeds the stream strategies with (see snapshot.py)
+        self.warm_history = {}
+
+    def add(self, strategy):
+        # strategies that take an alert_filter drop their repeats before building the alerts
+        if hasattr(strategy, 'alert_filter'):
+            strategy.alert_filter = partial(self.alert_state.allow, strategy.name)
+        self.strategies.append(strategy)
+        return strategy
+
+    def bar_strategies(self, multiplier=None, timespan=None):
+        return [strategy for strategy in self.strategies if hasattr(strategy, 'scan') and
+                (multiplier is None or (strategy.multiplier, strategy.timespan) == (multiplier, timespan))]
+
+    def stream_strategies(self):
+        return [strategy for strategy in self.strategies if hasattr(strategy, 'on_minute_bar')]
+
+    # the minute bars the stream strategies hold, by symbol
+    def minute_frames(self):
+        frames = {}
+        for strategy in self.stream_strategies():
+            if hasattr(strategy, 'minute_frames'):
+                frames.update(strategy.minute_frames())
+        return frames
+
+    # the symbols each strategy scans, from one shared universe snapshot
+    def strategy_symbols(self, strategies):
+        symbols = {strategy: self.universe.filter(**strategy.universe) for strategy in strategies}
+        if self.symbols is not None:
+            symbols = {strategy: [symbol for symbol in strategy_symbols if symbol in self.symbols]
+                       for strategy, strategy_symbols in symbols.items()}
+        return symbols
+
+    # whether each alert (row) of the frame is new to the alert state, before anything is formatted
+    # the alerts of strategies with an alert_filter have been checked already
+    def fresh(self, strategy, df):
+        if not hasattr(strategy, 'alert_keys') or getattr(strategy, 'alert_filter', None) is not None:
+            return [True] * len(df)
+        return [self.alert_state.allow(strategy.name, *keys) for keys in strategy.alert_keys(df)]
+
+    # queues the alert messages of a strategy's results, never waits on the network
+    # event_time is the time of the bar the results are about, for the alert latency
+    def publish(self, strategy, results_df, event_time=None):
+        if results_df is not None and not results_df.empty:
+            results_df = results_df[self.fresh(strategy, results_df)]
+        if results_df is None or results_df.empty:
+            print('No {} alerts'.format(strategy.name))
+            return
+        for page in paginate(results_df, max_df_rows_in_message):
+            with metrics.timer('format'):
+                message = format_alert(strategy.title, page, strategy.floatfmt, strategy.showindex)
+            self.alerts.submit(message, event_time, strategy.name)
+
+    # queues the alert of a stream strategy, event_time is the start of the bar it is about
+    def alert(self, strategy, alert_df, event_time):
+        if not all(self.fresh(strategy, alert_df)):
+            return
+        with metrics.timer('format'):
+            message = format_alert(strategy.title, alert_df, strategy.floatfmt, strategy.showindex)
+        self.alerts.submit(message, event_time, strategy.name)
+
+    async def forward_alerts(self, strategy):
+        async for alert_df, event_time in strategy.alerts():
+            self.alert(strategy, alert_df, event_time)
+
+    # refreshes the bars of one timeframe once for all the strategies on it and runs their scans
+    # the bars built from the minute stream are stored first, only the symbols whose stored bars
+    # do not reach up to the stream yet are refreshed from the api
+    # the universe and the api are asked off the event loop, so the stream and the alerts keep going
+    async def scan_bars(self, multiplier, timespan, bar_close=None):
+        loop = asyncio.get_event_loop()
+        strategies = self.bar_strategies(multiplier, timespan)
+        symbols = await loop.run_in_executor(None, self.strategy_symbols, strategies)
+        all_symbols = list(dict.fromkeys(symbol for strategy in strategies for symbol in symbols[strategy]))
+        timeframe = timeframe_key(multiplier, timespan)
+
+        now = datetime.now()
+        resampler = self.resamplers.get((multiplier, timespan))
+        covered = self.resampled.setdefault((multiplier, timespan), set())
+        stale = all_symbols
+        if resampler is not None:
+            until = int((bar_close or now).timestamp() * 1000)
+            for symbol, records in resampler.flush(until).items():
+                self.bar_store.write(symbol, timeframe, records)
+            # a minute that came in after its bar was built (late, or backfilled after a reconnect)
+            # leaves that bar wrong, the bars from it on are fetched from the api again
+            for symbol, start in resampler.take_late().items():
+                self.bar_store.truncate(symbol, timeframe, start)
+                covered.discard(symbol)
+            stale = [symbol for symbol in all_symbols if symbol not in covered]
+            # the scan runs resampled_settle_seconds after the close, the bars of the api are only
+            # complete at polygon after the full settle
+            if stale and bar_close is not None:
+                await asyncio.sleep(max(0, self.settle_seconds - resampled_settle_seconds))
+                now = datetime.now()
+
+        _from = (now - max(strategy.lookback for strategy in strategies)).strftime('%Y-%m-%d')
+        print('Getting {} bars for {} symbols...'.format(timeframe, len(stale)))
+        refreshed = await loop.run_in_executor(None, partial(
+            self.bar_store.refresh, self.api, stale, multiplier=multiplier, timespan=timespan, _from=_from,
+            to=now.strftime('%Y-%m-%d')
+        )) if stale else []
+        # the bars fetched once the bar forming when the stream started is complete reach up to
+        # the ones the resampler builds, symbols not on the stream are always fetched
+        if resampler is not None and now.timestamp() * 1000 >= resampler.whole_from:
+            covered.update(symbol for symbol in refreshed if symbol in self.stream_symbols)
+        refreshed = set(refreshed)
+        bars = {symbol: self.bar_store.load(symbol, timeframe) for symbol in all_symbols
+                if symbol in refreshed or symbol in covered}
+
+        for strategy in strategies:
+            print('Scanning {}...'.format(strategy.name))
+            results_df = strategy.scan(bars, [symbol for symbol in symbols[strategy] if symbol in bars])
+            self.publish(strategy, results_df, bar_close)
+
+    def timeframes(self):
+        return list(dict.fromkeys((strategy.multiplier, strategy.timespan) for strategy in self.bar_strategies()))
+
+    # the timeframes of the bar strategies that can be built from minute bars
+    def resampled_timeframes(self):
+        if not resample_bars:
+            return []
+        return [(multiplier, timespan) for multiplier, timespan in self.timeframes()
+                if timespan in ('minute', 'hour', 'day')]
+
+    # whether the engine needs the minute stream, for the stream strategies or the resampled bars
+    def needs_stream(self):
+        return bool(self.stream_strategies() or self.resampled_timeframes())
+
+    # starts building the bars of the resampled timeframes from the minute bars coming in from now on
+    def start_resampling(self):
+        since = int(datetime.now().timestamp() * 1000)
+        for multiplier, timespan in self.resampled_timeframes():
+            self.resamplers[(multiplier, timespan)] = Resampler(multiplier, timespan, self.scheduler.calendar, since)
+
+    def resample(self, data):
+        timestamp = int(data.start.timestamp() * 1000)
+        for resampler in self.resamplers.values():
+            resampler.update(data.symbol, timestamp, data.open, data.high, data.low, data.close, data.volume)
+
+    # runs every bar strategy once, now
+    async def run_once(self):
+        for multiplier, timespan in self.timeframes():
+            await self.scan_bars(multiplier, timespan)
+
+    # schedules every bar strategy on the closes of its timeframe, call from a running event loop
+    def start_scans(self, loop):
+        for multiplier, timespan in self.timeframes():
+            settle = resampled_settle_seconds if (multiplier, timespan) in self.resamplers else self.settle_seconds
+            self.scheduler.every(multiplier, timespan, partial(self.scan_bars, multiplier, timespan), settle=settle)
+        loop.create_task(self.scheduler.run())
+
+    # adds a minute bar to the batch, a bar of a newer minute evaluates the batch right away
+    def batch_minute_bar(self, data):
+        if self.minute_batch and data.start > self.batch_minute:
+            self.flush_minute_bars()
+        if not self.minute_batch:
+            self.batch_minute = data.start
+            self.batch_timer = asyncio.get_event_loop().call_later(minute_batch_seconds, self.flush_minute_bars)
+        self.minute_batch.append(data)
+
+    # evaluates the minute bars of the batch and queues their alerts
+    def flush_minute_bars(self):
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        bars, self.minute_batch = self.minute_batch, []
+        if not bars:
+            return
+        for strategy in self.batched:
+            for alert_df, event_time in strategy.on_minute_bars(bars):
+                self.alert(strategy, alert_df, event_time)
+
+    # starts the scheduled scans and the minute stream once (discord's on_ready fires on every reconnect)
+    async def start(self, loop, conn=None):
+        if self.started:
+            return
+        self.started = True
+        if metrics.metrics_port:
+            await metrics.serve()
+        if metrics.log_interval:
+            loop.create_task(metrics.log_every())
+        if conn is not None:
+            self.start_resampling()
+        self.start_scans(loop)
+        if conn is not None:
+            await self.start_stream(conn)
+
+    # seeds the stream strategies from one minute history fetch and subscribes the connection
+    # to the minute bars of all their symbols and of the symbols of the resampled bar strategies
+    async def start_stream(self, conn):
+        strategies = self.stream_strategies()
+        resampled = [strategy for strategy in self.bar_strategies()
+                     if (strategy.multiplier, strategy.timespan) in self.resamplers]
+        if not strategies and not resampled:
+            return
+        symbols = self.strategy_symbols(strategies + resampled)
+        all_symbols = list(dict.fromkeys(symbol for strategy in strategies for symbol in symbols[strategy]))
+        streamed = set(all_symbols)
+        subscribed = list(dict.fromkeys(all_symbols + [symbol for strategy in resampled for symbol in symbols[strategy]]))
+
+        # symbols with minute bars from a snapshot are seeded with those, the rest are fetched
+        minute_history = {symbol: self.warm_history[symbol] for symbol in all_symbols if symbol in self.warm_history}
+        missing = [symbol for symbol in all_symbols if symbol not in minute_history]
+        if missing and strategies:
+            now = datetime.now()
+            _from = min(strategy.history_from() for strategy in strategies)
+            minute_history.update(fetch_history(
+                self.api, missing, multiplier=1, timespan="minute", _from=_from, to=now.strftime('%Y-%m-%d')
+            ))
+        warm = {symbol: int(df.index[-1].value // 10**6) for symbol, df in minute_history.items()
+                if symbol in self.warm_history and len(df)}
+        self.warm_history = {}
+        for strategy in strategies:
+            # strategies evaluated off the event loop batch the bars themselves, like the engine does
+            if hasattr(strategy, 'batch_minute_bars'):
+                strategy.batch_minute_bars = minute_batch_seconds is not None
+            strategy.seed({symbol: minute_history[symbol] for symbol in symbols[strategy] if symbol in minute_history})
+            # strategies evaluated off the event loop (see parallel.py) hand their alerts back later
+            if hasattr(strategy, 'alerts'):
+                asyncio.ensure_future(self.forward_alerts(strategy))
+
+        if minute_batch_seconds is not None:
+            self.batched = [strategy for strategy in strategies if hasattr(strategy, 'on_minute_bars')]
+        single = [strategy for strategy in strategies if strategy not in self.batched]
+
+        @conn.on(r'AM$')
+        async def handle_minute_bar(conn, channel, data):
+            if self.resamplers:
+                self.resample(data)
+            # symbols only subscribed for the resampled bars are not the stream strategies' business
+            if data.symbol not in streamed:
+                return
+            if self.batched:
+                self.batch_minute_bar(data)
+            for strategy in single:
+                alert_df = strategy.on_minute_bar(data)
+                if alert_df is not None:
+                    self.alert(strategy, alert_df, data.start)
+
+        self.stream_symbols.update(subscribed)
+
+        # only the minute bars have a handler, so only those channels are subscribed
+        print('Watching {} symbols.'.format(len(subscribed)))
+        await conn.subscribe(['AM.{}'.format(symbol) for symbol in subscribed])
+
+        # the bars since the snapshot are backfilled ahead of the live bars of those symbols
+        if warm and hasattr(conn, 'request_backfill'):
+            conn.request_backfill(warm, since=warm)
+
+        # sharded connections follow the message rates measured on them
+        if hasattr(conn, 'rebalance_every') and sharding.rebalance_interval:
+            asyncio.ensure_future(conn.rebalance_every(sharding.rebalance_interval))
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bars import compact_frame
+import metrics
+
+# maximum number of history requests in flight at once
+max_concurrent_requests = 16
+
+# sustained request rate allowed against the data api (requests per second)
+requests_per_second = 50
+
+# number of times a failed request is retried before the symbol is given up on
+max_retries = 3
+
+# base delay (seconds) for the exponential retry backoff
+retry_backoff = 0.5
+
+
+# token bucket shared by all the worker threads of a fetch
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # blocks until a token is available and takes it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# returns the http status of a failed request if there is one
+def _status_code(e):
+    response = getattr(e, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+# client errors other than rate limiting will not succeed on a retry
+def _is_retryable(e):
+    status = _status_code(e)
+    return status is None or status == 429 or status >= 500
+
+
+# calls fn(symbol) with rate limiting and retry with jittered backoff
+def _call_with_retry(fn, symbol, bucket, retries, backoff):
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return fn(symbol)
+        except Exception as e:
+            metrics.inc('scanner_api_errors_total', status=_status_code(e) or 'none')
+            if attempt >= retries or not _is_retryable(e):
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+
+# runs fn(symbol) for every symbol on a bounded thread pool
+# a symbol that keeps failing is reported and left out of the results, it never stops the others
+def fetch_all(fn, symbols, max_workers=None, rate=None, retries=None, backoff=None):
+    max_workers = max_workers or max_concurrent_requests
+    bucket = TokenBucket(rate or requests_per_second)
+    retries = max_retries if retries is None else retries
+    backoff = retry_backoff if backoff is None else backoff
+
+    results = {}
+    c = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_call_with_retry, fn, symbol, bucket, retries, backoff): symbol
+            for symbol in symbols
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            c += 1
+            try:
+                results[symbol] = future.result()
+            except Exception as e:
+                print('Failed to fetch {}: {}'.format(symbol, e))
+                metrics.inc('scanner_symbols_skipped_total', reason='fetch')
+                continue
+            print('{}/{}'.format(c, len(futures)))
+    return results
+
+
+# returns the historical bars for each symbol as a dict of dataframes in the compact bar dtypes
+def fetch_history(api, symbols, multiplier, timespan, _from, to, **kwargs):
+    def fetch(symbol):
+        return compact_frame(api.polygon.historic_agg_v2(
+            symbol=symbol, multiplier=multiplier, timespan=timespan, _from=_from, to=to
+        ).df)
+    with metrics.timer('history_fetch'):
+        return fetch_all(fetch, symbols, **kwargs)
@@ -0,0 +1,89 @@
+import numpy as np
+
+# Heikin-Ashi columns in the order they are added to a bar frame
+HA_FIELDS = ('HA_Close', 'HA_Open', 'HA_High', 'HA_Low')
+
+nan = float('nan')
+
+# HA open is solved in blocks of this many bars, 2 ** block stays well inside float range
+_block = 64
+
+
+# solves ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2 along the last axis
+# within a block ha_open[s+j] = (ha_open[s] + sum(2**k * ha_close[s+k] for k < j)) / 2**j
+def _ha_open(ha_close, first_open):
+    out = np.empty(ha_close.shape)
+    n = ha_close.shape[-1]
+    weights = 2.0 ** np.arange(_block)
+    current = np.asarray(first_open, dtype=float)
+    for start in range(0, n, _block):
+        block = ha_close[..., start:start + _block]
+        m = block.shape[-1]
+        sums = np.cumsum(block[..., :m - 1] * weights[:m - 1], axis=-1)
+        sums = np.concatenate([np.zeros(block.shape[:-1] + (1,)), sums], axis=-1)
+        out[..., start:start + m] = (current[..., None] + sums) / weights[:m]
+        current = (out[..., start + m - 1] + block[..., -1]) / 2
+    return out
+
+
+# returns the Heikin-Ashi open, high, low and close for whole arrays of bars (time on the last axis)
+# the first HA open is (open + close) / 2 of the first bar unless first_open is given
+def heikin_ashi(open, high, low, close, first_open=None):
+    open, high, low, close = (np.asarray(values, dtype=float) for values in (open, high, low, close))
+    ha_close = (open + high + low + close) / 4
+    if ha_close.shape[-1] == 0:
+        return ha_close.copy(), ha_close.copy(), ha_close.copy(), ha_close
+    if first_open is None:
+        first_open = (open[..., 0] + close[..., 0]) / 2
+    ha_open = _ha_open(ha_close, first_open)
+    ha_high = np.maximum(np.maximum(ha_open, ha_close), high)
+    ha_low = np.minimum(np.minimum(ha_open, ha_close), low)
+    return ha_open, ha_high, ha_low, ha_close
+
+
+# adds the HA_Close, HA_Open, HA_High and HA_Low columns to a bar frame
+def add_heikin_ashi(df):
+    ha_open, ha_high, ha_low, ha_close = heikin_ashi(df['open'].values, df['high'].values,
+                                                     df['low'].values, df['close'].values)
+    df['HA_Close'] = ha_close
+    df['HA_Open'] = ha_open
+    df['HA_High'] = ha_high
+    df['HA_Low'] = ha_low
+    return df
+
+
+# streaming Heikin-Ashi for one symbol, keeps the previous HA open / close so each bar is O(1)
+class HeikinAshiState:
+
+    __slots__ = ('ha_open', 'ha_close', 'prev_ha_open', 'prev_ha_close')
+
+    def __init__(self, ha_open=nan, ha_close=nan):
+        self.ha_open = ha_open
+        self.ha_close = ha_close
+        self.prev_ha_open = nan
+        self.prev_ha_close = nan
+
+    # seeds the state from the last bar of a frame with the HA columns
+    @classmethod
+    def from_frame(cls, df):
+        state = cls()
+        if len(df) > 1:
+            state.prev_ha_open, state.prev_ha_close = float(df['HA_Open'].iloc[-2]), float(df['HA_Close'].iloc[-2])
+        if len(df) > 0:
+            state.ha_open, state.ha_close = float(df['HA_Open'].iloc[-1]), float(df['HA_Close'].iloc[-1])
+        return state
+
+    # returns the HA close, open, high and low of a new bar
+    # replace=True recomputes the latest bar instead of advancing (a revised bar)
+    def update(self, open, high, low, close, replace=False):
+        if replace:
+            self.ha_open, self.ha_close = self.prev_ha_open, self.prev_ha_close
+        self.prev_ha_open, self.prev_ha_close = self.ha_open, self.ha_close
+
+        ha_close = (open + high + low + close) / 4
+        if self.ha_open != self.ha_open:
+            ha_open = (open + close) / 2
+        else:
+            ha_open = (self.ha_open + self.ha_close) / 2
+        self.ha_open, self.ha_close = ha_open, ha_close
+        return ha_close, ha_open, max(ha_open, ha_close, high), min(ha_open, ha_close, low)
@@ -0,0 +1,123 @@
+import math
+from collections import deque
+
+nan = float('nan')
+
+
+# streaming 13/30 crossover indicators for one symbol
+# each new bar updates the running sma sums and Wilder's rsi averages in constant time
+class CrossoverState:
+
+    __slots__ = (
+        'sma_fast', 'sma_slow', 'rsi_period', 'closes', 'count', 'last_timestamp',
+        'fast_sum', 'slow_sum', 'fast_value', 'slow_value', 'prev_fast_value', 'prev_slow_value',
+        'close', 'prev_close', 'volume', 'diff_count', 'gain_sum', 'loss_sum', 'avg_gain', 'avg_loss',
+        'rsi', 'undo',
+    )
+
+    def __init__(self, sma_fast, sma_slow, rsi_period=14):
+        self.sma_fast = sma_fast
+        self.sma_slow = sma_slow
+        self.rsi_period = rsi_period
+        self.closes = deque(maxlen=max(sma_fast, sma_slow) + 1)
+        self.count = 0
+        self.last_timestamp = None
+        self.fast_sum = self.slow_sum = 0.0
+        self.fast_value = self.slow_value = nan
+        self.prev_fast_value = self.prev_slow_value = nan
+        self.close = self.prev_close = self.volume = nan
+        self.diff_count = 0
+        self.gain_sum = self.loss_sum = 0.0
+        self.avg_gain = self.avg_loss = nan
+        self.rsi = nan
+        self.undo = None
+
+    def _snapshot(self):
+        return (
+            self.count, self.last_timestamp, self.fast_sum, self.slow_sum, self.fast_value, self.slow_value,
+            self.prev_fast_value, self.prev_slow_value, self.close, self.prev_close, self.volume,
+            self.diff_count, self.gain_sum, self.loss_sum, self.avg_gain, self.avg_loss, self.rsi,
+        )
+
+    def _restore(self, snapshot):
+        (
+            self.count, self.last_timestamp, self.fast_sum, self.slow_sum, self.fast_value, self.slow_value,
+            self.prev_fast_value, self.prev_slow_value, self.close, self.prev_close, self.volume,
+            self.diff_count, self.gain_sum, self.loss_sum, self.avg_gain, self.avg_loss, self.rsi,
+        ) = snapshot
+
+    # adds a new bar, a bar with the same timestamp as the last one replaces it
+    # (the latest bar can still be forming when it is first fetched)
+    def update(self, timestamp, close, volume):
+        if timestamp == self.last_timestamp and self.undo is not None:
+            snapshot, dropped = self.undo
+            self.closes.pop()
+            if dropped is not None:
+                self.closes.appendleft(dropped)
+            self._restore(snapshot)
+
+        dropped = self.closes[0] if len(self.closes) == self.closes.maxlen else None
+        self.undo = (self._snapshot(), dropped)
+
+        closes = self.closes
+        closes.append(close)
+        self.count += 1
+
+        # running sums, recomputed once per window to keep float error from building up
+        if self.count % closes.maxlen == 0:
+            values = list(closes)
+            self.fast_sum = math.fsum(values[-self.sma_fast:])
+            self.slow_sum = math.fsum(values[-self.sma_slow:])
+        else:
+            self.fast_sum += close
+            self.slow_sum += close
+            if len(closes) > self.sma_fast:
+                self.fast_sum -= closes[-self.sma_fast - 1]
+            if len(closes) > self.sma_slow:
+                self.slow_sum -= closes[-self.sma_slow - 1]
+
+        self.prev_fast_value = self.fast_value
+        self.prev_slow_value = self.slow_value
+        self.fast_value = self.fast_sum / self.sma_fast if self.count >= self.sma_fast else nan
+        self.slow_value = self.slow_sum / self.sma_slow if self.count >= self.sma_slow else nan
+
+        self.prev_close = self.close
+        self.close = close
+        self.volume = volume
+        self.last_timestamp = timestamp
+
+        # Wilder's rsi, seeded with the simple average of the first rsi_period changes like talib
+        if self.count > 1:
+            diff = close - self.prev_close
+            gain = diff if diff > 0 else 0.0
+            loss = -diff if diff < 0 else 0.0
+            period = self.rsi_period
+            self.diff_count += 1
+            if self.diff_count < period:
+                self.gain_sum += gain
+                self.loss_sum += loss
+            elif self.diff_count == period:
+                self.avg_gain = (self.gain_sum + gain) / period
+                self.avg_loss = (self.loss_sum + loss) / period
+            else:
+                self.avg_gain = (self.avg_gain * (period - 1) + gain) / period
+                self.avg_loss = (self.avg_loss * (period - 1) + loss) / period
+            if self.diff_count >= period:
+                total = self.avg_gain + self.avg_loss
+                self.rsi = 100 * self.avg_gain / total if total > 0 else 0.0
+
+    # returns 'Up' / 'Down' if the last bar crossed the fast sma over / under the slow one
+    def cross(self):
+        if self.fast_value > self.slow_value and self.prev_fast_value < self.prev_slow_value:
+            return 'Up'
+        if self.fast_value < self.slow_value and self.prev_fast_value > self.prev_slow_value:
+            return 'Down'
+        return None
+
+    @property
+    def price_change(self):
+        return self.close - self.prev_close
+
+    @property
+    def perc_change(self):
+        return (self.close - self.prev_close) / self.prev_close * 100
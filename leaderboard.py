@@ -0,0 +1,288 @@
+import asyncio
+import collections
+import math
+from datetime import datetime, timedelta
+import pandas as pd
+import metrics
+
+# symbols on each board
+leaderboard_size = 10
+
+# minutes a symbol stays on the boards after its last bar, measured from the newest bar of the stream
+max_bar_age = 15
+
+# seconds between the digests of the boards sent as alerts, None sends none
+digest_interval = 300
+
+
+# binary heap of keyed scores with the position of every key, so the score of any key can be
+# changed or removed in O(log n) instead of rebuilding the heap
+# the smallest score is on top, or the largest with largest=True
+class IndexedHeap:
+
+    def __init__(self, largest=False):
+        self.sign = -1 if largest else 1
+        self.heap = []
+        self.pos = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.pos
+
+    def score(self, key):
+        return self.heap[self.pos[key]][0] * self.sign
+
+    # (key, score) of the top entry
+    def peek(self):
+        value, key = self.heap[0]
+        return key, value * self.sign
+
+    # adds a key or changes its score
+    def push(self, key, score):
+        value = score * self.sign
+        i = self.pos.get(key)
+        if i is None:
+            self.heap.append([value, key])
+            self.pos[key] = len(self.heap) - 1
+            self._up(len(self.heap) - 1)
+            return
+        old = self.heap[i][0]
+        self.heap[i][0] = value
+        if value < old:
+            self._up(i)
+        else:
+            self._down(i)
+
+    def pop(self):
+        key, score = self.peek()
+        self.remove(key)
+        return key, score
+
+    def remove(self, key):
+        i = self.pos.pop(key)
+        last = self.heap.pop()
+        if i == len(self.heap):
+            return
+        self.heap[i] = last
+        self.pos[last[1]] = i
+        self._up(i)
+        self._down(self.pos[last[1]])
+
+    def items(self):
+        return [(key, value * self.sign) for value, key in self.heap]
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.pos[heap[i][1]] = i
+        self.pos[heap[j][1]] = j
+
+    def _up(self, i):
+        heap = self.heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[i][0] >= heap[parent][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _down(self, i):
+        heap = self.heap
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1][0] < heap[child][0]:
+                child += 1
+            if heap[child][0] >= heap[i][0]:
+                break
+            self._swap(i, child)
+            i = child
+
+
+# the k keys with the highest scores, kept as a min-heap of the leaders over a max-heap of the rest
+# a new score only moves the key within its heap and swaps the tops when they cross, so every
+# update is O(log n) and the universe is never sorted
+class TopK:
+
+    def __init__(self, k):
+        self.k = k
+        self.top = IndexedHeap()
+        self.rest = IndexedHeap(largest=True)
+
+    def __len__(self):
+        return len(self.top) + len(self.rest)
+
+    # sets the score of a key, a nan score takes the key off the board
+    def update(self, key, score):
+        if math.isnan(score):
+            self.remove(key)
+            return
+        if key in self.top:
+            self.top.push(key, score)
+        else:
+            self.rest.push(key, score)
+        self._balance()
+
+    def remove(self, key):
+        if key in self.top:
+            self.top.remove(key)
+        elif key in self.rest:
+            self.rest.remove(key)
+        else:
+            return
+        self._balance()
+
+    def _balance(self):
+        while len(self.top) < self.k and self.rest:
+            self.top.push(*self.rest.pop())
+        while self.top and self.rest and self.rest.peek()[1] > self.top.peek()[1]:
+            leader, demoted = self.rest.pop(), self.top.pop()
+            self.top.push(*leader)
+            self.rest.push(*demoted)
+
+    # the (key, score) of the leaders, highest first
+    def leaders(self):
+        return sorted(self.top.items(), key=lambda item: -item[1])
+
+
+# the minute bars of one symbol the scores are taken from: the bar forming the scores and the
+# trend bars before it (their volumes and bar sizes)
+class _Trend:
+
+    def __init__(self, trend_bar_count):
+        self.timestamp = None
+        self.bar = None
+        self.prev_close = math.nan
+        self.volumes = collections.deque(maxlen=trend_bar_count)
+        self.sizes = collections.deque(maxlen=trend_bar_count)
+
+    # a bar with the latest timestamp replaces it, older bars are ignored
+    def add(self, timestamp, open, close, volume):
+        if self.timestamp is not None and timestamp < self.timestamp:
+            return False
+        if self.timestamp is not None and timestamp > self.timestamp:
+            bar_open, bar_close, bar_volume = self.bar
+            self.prev_close = bar_close
+            self.volumes.append(bar_volume)
+            self.sizes.append(abs(bar_close - bar_open))
+        self.timestamp = timestamp
+        self.bar = (open, close, volume)
+        return True
+
+    def scores(self):
+        open, close, volume = self.bar
+        volume_avg = sum(self.volumes) / len(self.volumes) if self.volumes else 0
+        size_avg = sum(self.sizes) / len(self.sizes) if self.sizes else 0
+        return (
+            (close - self.prev_close) / self.prev_close * 100 if self.prev_close else math.nan,
+            volume / volume_avg if volume_avg else math.nan,
+            abs(close - open) / size_avg if size_avg else math.nan,
+        )
+
+
+# live leaderboard of the top movers of the minute stream, a stream strategy that never alerts
+# on a threshold: every bar updates its symbol's % price change, volume against the trend average
+# and bar size against the trend average on a TopK board each, top() answers at any time and
+# alerts() yields a digest of the boards every digest_interval seconds
+# symbols whose last bar is more than max_age minutes behind the newest bar leave the boards
+class Leaderboard:
+
+    name = 'leaders'
+    title = 'Top Movers:'
+    floatfmt = ",.2f"
+    showindex = True
+
+    boards = ('%_price_change', 'volume_factor', 'bar_size_factor')
+
+    def __init__(self, size=None, trend_bar_count=10, min_share_price=.50, max_share_price=None,
+                 minimum_daily_volume=100000, digest_seconds=None, max_age=None):
+        self.size = size or leaderboard_size
+        self.trend_bar_count = trend_bar_count
+        self.digest_seconds = digest_interval if digest_seconds is None else digest_seconds
+        self.universe = {'min_price': min_share_price, 'max_price': max_share_price,
+                         'min_volume': minimum_daily_volume}
+        self.top_k = {board: TopK(self.size) for board in self.boards}
+        self.trends = {}
+        # the last bar timestamp (epoch ms) of every symbol on the boards, oldest on top
+        self.max_age_ms = (max_bar_age if max_age is None else max_age) * 60 * 1000
+        self.last_bars = IndexedHeap()
+        self.newest = 0
+        self.updated = False
+
+    def history_from(self):
+        return (datetime.now() - timedelta(minutes=30)).strftime('%Y-%m-%d')
+
+    # starts the boards from the last bars of the minute history
+    def seed(self, history, rings=None):
+        for symbol, df in history.items():
+            trend = self.trends[symbol] = _Trend(self.trend_bar_count)
+            df = df.tail(self.trend_bar_count + 1)
+            timestamps = df.index.values.astype('datetime64[ms]').astype('i8').tolist()
+            for timestamp, open, close, volume in zip(timestamps, df['open'].tolist(), df['close'].tolist(),
+                                                      df['volume'].tolist()):
+                trend.add(timestamp, open, close, volume)
+            if trend.bar is not None:
+                self._score(symbol)
+
+    def _score(self, symbol):
+        trend = self.trends[symbol]
+        for board, score in zip(self.boards, trend.scores()):
+            self.top_k[board].update(symbol, score)
+        self.last_bars.push(symbol, trend.timestamp)
+        self.newest = max(self.newest, trend.timestamp)
+        self.updated = True
+
+    # takes the symbols that have gone quiet off the boards
+    def _age_out(self):
+        while self.last_bars and self.last_bars.peek()[1] < self.newest - self.max_age_ms:
+            symbol, _ = self.last_bars.pop()
+            for top_k in self.top_k.values():
+                top_k.remove(symbol)
+
+    def _add(self, data):
+        trend = self.trends.get(data.symbol)
+        if trend is None:
+            trend = self.trends[data.symbol] = _Trend(self.trend_bar_count)
+        if trend.add(int(data.start.timestamp() * 1000), data.open, data.close, data.volume):
+            self._score(data.symbol)
+
+    def on_minute_bar(self, data):
+        metrics.inc('scanner_bars_processed_total', scan=self.name)
+        self._add(data)
+        return None
+
+    def on_minute_bars(self, bars):
+        metrics.inc('scanner_bars_processed_total', len(bars), scan=self.name)
+        for data in bars:
+            self._add(data)
+        return []
+
+    # the leaders of a board as (symbol, score), highest first
+    def top(self, board, k=None):
+        self._age_out()
+        return self.top_k[board].leaders()[:k]
+
+    # the boards side by side, ranked from 1
+    def frame(self):
+        columns = {}
+        for board in self.boards:
+            leaders = self.top(board)
+            columns[board + ' symbol'] = pd.Series([symbol for symbol, _ in leaders], dtype=object)
+            columns[board] = pd.Series([score for _, score in leaders], dtype=float)
+        df = pd.DataFrame(columns)
+        df.index = df.index + 1
+        return df
+
+    # yields (digest frame, None) every digest_seconds while bars come in
+    async def alerts(self):
+        if not self.digest_seconds:
+            return
+        while True:
+            await asyncio.sleep(self.digest_seconds)
+            if self.updated:
+                self.updated = False
+                yield self.frame(), None
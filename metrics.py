@@ -0,0 +1,170 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import threading
+import time
+
+# port the prometheus text endpoint is served on by the engine, None to not serve it
+metrics_port = None
+
+# seconds between the structured metrics log lines the engine prints, None to not print them
+log_interval = None
+
+# upper bounds (seconds) of the latency histogram buckets
+latency_buckets = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {
+    'scanner_stage_seconds': 'Time spent in each scan stage.',
+    'scanner_alert_latency_seconds': 'Time from the bar an alert is about to the alert being sent.',
+    'scanner_bars_processed_total': 'Bars evaluated by the strategies.',
+    'scanner_symbols_skipped_total': 'Symbols left out of a scan (no history, failed fetch, unknown symbol).',
+    'scanner_api_errors_total': 'Failed api requests, retried ones included.',
+    'scanner_alerts_total': 'Alerts sent.',
+    'scanner_alerts_suppressed_total': 'Repeat alerts dropped within their cooldown or about an already alerted bar.',
+    'scanner_stream_subscriptions_total': 'Channels subscribed on each stream connection.',
+    'scanner_stream_dropped_total': 'Stream bars dropped or merged away because the ingest queue was full.',
+    'scanner_stream_reconnects_total': 'Stream connections closed and reopened.',
+    'scanner_stream_backfilled_bars_total': 'Missed minute bars fetched from the rest api after a gap.',
+    'scanner_stream_backfill_failed_total': 'Symbols released without their missed bars after the backfill retries ran out.',
+    'scanner_resampled_late_bars_total': 'Minute bars that came in after the resampled bar they belong to was complete.',
+}
+
+
+# counts and sums of the observations per bucket, like a prometheus histogram
+class Histogram:
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# adds value to a counter
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+# records an observation (seconds) in a histogram
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+# times the block as a stage of a scan
+@contextlib.contextmanager
+def timer(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('scanner_stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _labels(labels, **extra):
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+# all the metrics in the prometheus text exposition format
+def render():
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in _histograms.items())
+
+    lines = []
+    described = set()
+
+    def describe(name, kind):
+        if name not in described:
+            described.add(name)
+            if name in _help:
+                lines.append('# HELP {} {}'.format(name, _help[name]))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for (name, labels), value in counters:
+        describe(name, 'counter')
+        lines.append('{}{} {}'.format(name, _labels(labels), value))
+    for (name, labels), (buckets, counts, total, count) in histograms:
+        describe(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{} {}'.format(name, _labels(labels, le=bound), cumulative))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), total))
+        lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+# the metrics as one dict: counters by name and labels, histograms as count / sum / mean
+def snapshot():
+    with _lock:
+        counters = {_flat(key): value for key, value in _counters.items()}
+        histograms = {_flat(key): {'count': h.count, 'sum': round(h.sum, 6),
+                                   'mean': round(h.sum / h.count, 6) if h.count else None}
+                      for key, h in _histograms.items()}
+    return {'time': time.time(), 'counters': counters, 'histograms': histograms}
+
+
+def _flat(key):
+    name, labels = key
+    return name + _labels(labels)
+
+
+# prints the metrics as a single json line
+def log():
+    print(json.dumps(snapshot(), sort_keys=True))
+
+
+# prints the metrics line every interval seconds
+async def log_every(interval=None):
+    while True:
+        await asyncio.sleep(interval or log_interval)
+        log()
+
+
+async def _handle(reader, writer):
+    try:
+        await reader.readuntil(b'\r\n\r\n')
+        body = render().encode()
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# serves the prometheus text on every request to the port (GET /metrics for a scraper)
+async def serve(port=None, host='0.0.0.0'):
+    server = await asyncio.start_server(_handle, host, port or metrics_port)
+    print('Serving metrics on port {}'.format(port or metrics_port))
+    return server
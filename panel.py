@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+tz = 'America/New_York'
+
+
+# the bars of many symbols laid out as aligned (symbol x time) arrays
+# each symbol is right aligned on its latest bar and padded on the left with nan / NaT
+class Panel:
+
+    def __init__(self, symbols, timestamps, columns):
+        self.symbols = symbols
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def shape(self):
+        return self.timestamps.shape
+
+    # returns the timestamps of the given (row, col) cells as ny time
+    def times(self, rows, cols):
+        return pd.to_datetime(self.timestamps[rows, cols], utc=True).tz_convert(tz)
+
+
+# builds a panel from a dict of per-symbol bar dataframes
+# length limits the panel to the last n bars of each symbol (defaults to the longest history)
+# session_hours=(start, end) drops bars outside those hours (ny time) before aligning
+def build_panel(history, symbols=None, columns=('close', 'volume'), length=None, session_hours=None):
+    symbols = [symbol for symbol in (symbols or history) if symbol in history]
+    frames = [history[symbol] for symbol in symbols]
+    width = max([len(df) for df in frames], default=0)
+
+    timestamps = np.full((len(symbols), width), np.datetime64('NaT'), dtype='datetime64[ms]')
+    arrays = {column: np.full((len(symbols), width), np.nan) for column in columns}
+    for i, df in enumerate(frames):
+        n = len(df)
+        if n == 0:
+            continue
+        timestamps[i, width - n:] = df.index.values.astype('datetime64[ms]')
+        for column in columns:
+            arrays[column][i, width - n:] = df[column].values
+
+    if session_hours is not None:
+        timestamps, arrays = _session_filter(timestamps, arrays, session_hours)
+        width = timestamps.shape[1]
+
+    if length is not None and length < width:
+        timestamps = timestamps[:, width - length:]
+        arrays = {column: values[:, width - length:] for column, values in arrays.items()}
+    elif length is not None and length > width:
+        pad = length - width
+        timestamps = np.concatenate(
+            [np.full((len(symbols), pad), np.datetime64('NaT'), dtype='datetime64[ms]'), timestamps], axis=1)
+        arrays = {column: np.concatenate([np.full((len(symbols), pad), np.nan), values], axis=1)
+                  for column, values in arrays.items()}
+
+    return Panel(symbols, timestamps, arrays)
+
+
+# builds a panel from a dict of bar record arrays (see bars.BAR_DTYPE)
+# length limits the panel to the last n bars of each symbol (defaults to the longest history)
+def panel_from_records(bars, symbols=None, columns=('close', 'volume'), length=None):
+    symbols = [symbol for symbol in (symbols or bars) if symbol in bars]
+    width = length if length is not None else max([len(bars[symbol]) for symbol in symbols], default=0)
+
+    timestamps = np.full((len(symbols), width), np.datetime64('NaT'), dtype='datetime64[ms]')
+    arrays = {column: np.full((len(symbols), width), np.nan) for column in columns}
+    for i, symbol in enumerate(symbols):
+        records = bars[symbol][max(len(bars[symbol]) - width, 0):] if width else bars[symbol][:0]
+        n = len(records)
+        if n == 0:
+            continue
+        timestamps[i, width - n:] = records['timestamp'].astype('datetime64[ms]')
+        for column in columns:
+            arrays[column][i, width - n:] = records[column]
+    return Panel(symbols, timestamps, arrays)
+
+
+# drops the cells outside the session hours and right aligns what is left in each row
+def _session_filter(timestamps, arrays, session_hours):
+    valid = ~np.isnat(timestamps)
+    hours = np.full(timestamps.shape, -1)
+    hours[valid] = pd.to_datetime(timestamps[valid], utc=True).tz_convert(tz).hour
+    keep = (hours >= session_hours[0]) & (hours < session_hours[1])
+
+    # a stable sort on the mask moves the kept cells to the end of each row in order
+    order = np.argsort(keep, axis=1, kind='stable')
+    keep = np.take_along_axis(keep, order, axis=1)
+    width = int(keep.sum(axis=1).max()) if len(keep) else 0
+    start = keep.shape[1] - width
+
+    timestamps = np.take_along_axis(timestamps, order, axis=1)[:, start:]
+    timestamps[~keep[:, start:]] = np.datetime64('NaT')
+    filtered = {}
+    for column, values in arrays.items():
+        values = np.take_along_axis(values, order, axis=1)[:, start:]
+        values[~keep[:, start:]] = np.nan
+        filtered[column] = values
+    return timestamps, filtered
+
+
+# returns the array shifted one bar to the right along the time axis
+def shift(values, periods=1):
+    shifted = np.full(values.shape, np.nan)
+    if periods < values.shape[1]:
+        shifted[:, periods:] = values[:, :-periods]
+    return shifted
+
+
+# rolling mean along the time axis, nan until a full window of valid values is available
+def rolling_mean(values, window):
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=1)
+    counts = np.cumsum(valid, axis=1)
+    sums = np.concatenate([np.zeros((len(values), 1)), sums], axis=1)
+    counts = np.concatenate([np.zeros((len(values), 1), dtype=counts.dtype), counts], axis=1)
+
+    out = np.full(values.shape, np.nan)
+    if window <= values.shape[1]:
+        window_sums = sums[:, window:] - sums[:, :-window]
+        window_counts = counts[:, window:] - counts[:, :-window]
+        out[:, window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return out
+
+
+# Wilder's RSI along the time axis, matches talib.RSI for each row
+# the loop runs over time only, every step handles all the symbols at once
+def rsi(close, period=14):
+    diff = np.diff(close, axis=1)
+    valid = ~np.isnan(diff)
+    gain = np.where(diff > 0, diff, 0.0)
+    loss = np.where(diff < 0, -diff, 0.0)
+    counts = np.cumsum(valid, axis=1)
+    gain_sums = np.cumsum(gain, axis=1)
+    loss_sums = np.cumsum(loss, axis=1)
+
+    out = np.full(close.shape, np.nan)
+    avg_gain = np.full(len(close), np.nan)
+    avg_loss = np.full(len(close), np.nan)
+    for t in range(diff.shape[1]):
+        seed = counts[:, t] == period
+        running = counts[:, t] > period
+        avg_gain = np.where(seed, gain_sums[:, t] / period,
+                            np.where(running, (avg_gain * (period - 1) + gain[:, t]) / period, avg_gain))
+        avg_loss = np.where(seed, loss_sums[:, t] / period,
+                            np.where(running, (avg_loss * (period - 1) + loss[:, t]) / period, avg_loss))
+        total = avg_gain + avg_loss
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = np.where(total > 0, 100 * avg_gain / total, 0.0)
+        out[:, t + 1] = np.where(seed | running, value, np.nan)
+    return out
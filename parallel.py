@@ -0,0 +1,144 @@
+import asyncio
+import copy
+import multiprocessing
+import os
+from collections import namedtuple
+import metrics
+from ring_buffer import BAR_FIELDS, SharedBarRings
+from sharding import shard_of
+
+# worker processes the stream evaluation is spread across
+eval_workers = os.cpu_count()
+
+# the fields of an AM message the strategies use, sent to the workers instead of the message
+MinuteBar = namedtuple('MinuteBar', 'symbol start open high low close volume')
+
+
+# evaluates the bars of its symbols with its own copy of the strategy, on the shared bar history
+# the bars sent together are evaluated as one batch if batch and the strategy takes batches
+def _worker(strategy, spec, symbols, inbox, outbox, batch):
+    rings = SharedBarRings(*spec)
+    strategy.attach(rings, symbols)
+    try:
+        while True:
+            bars = inbox.get()
+            if bars is None:
+                break
+            if batch and hasattr(strategy, 'on_minute_bars'):
+                for alert in strategy.on_minute_bars(bars):
+                    outbox.put(alert)
+                continue
+            for bar in bars:
+                alert_df = strategy.on_minute_bar(bar)
+                if alert_df is not None:
+                    outbox.put((alert_df, bar.start))
+    finally:
+        strategy.minute_history = {}
+        rings.close()
+        outbox.put(None)
+
+
+# runs a stream strategy (seed / attach / on_minute_bar) on a pool of worker processes
+# the event loop only hands the bars out: each worker owns the symbols that hash to it and
+# evaluates their bars on the ring buffers in shared memory, so a burst of bars on the minute
+# is spread over the cores and only the bars themselves are sent to the workers
+# the alerts come back through alerts() instead of being returned by on_minute_bar
+# batch_minute_bars has the workers evaluate each batch with on_minute_bars, the engine turns it
+# off with its minute batches (see engine.minute_batch_seconds)
+class ParallelStrategy:
+
+    def __init__(self, strategy, workers=None, batch_minute_bars=True):
+        self.strategy = strategy
+        self.template = copy.deepcopy(strategy)
+        self.workers = workers or eval_workers
+        self.batch_minute_bars = batch_minute_bars
+        for attr in ('name', 'title', 'floatfmt', 'showindex', 'universe'):
+            setattr(self, attr, getattr(strategy, attr))
+        if hasattr(strategy, 'alert_keys'):
+            self.alert_keys = strategy.alert_keys
+        self.rings = None
+        self.owners = {}
+        self.inboxes = []
+        self.outbox = None
+        self.processes = []
+        self.pending = None
+
+    def history_from(self):
+        return self.strategy.history_from()
+
+    # seeds the shared bar history and starts the workers on it
+    def seed(self, history):
+        symbols = list(history)
+        self.rings = SharedBarRings(symbols, self.strategy.capacity, self.strategy.fields)
+        self.strategy.seed(history, self.rings)
+        # the workers keep the state from here on
+        self.strategy.minute_history = {}
+        self.strategy.ha_states = {}
+
+        self.owners = {symbol: shard_of(symbol, self.workers) for symbol in symbols}
+        context = multiprocessing.get_context()
+        self.outbox = context.Queue()
+        self.inboxes = [context.Queue() for _ in range(self.workers)]
+        for worker, inbox in enumerate(self.inboxes):
+            worker_symbols = [symbol for symbol in symbols if self.owners[symbol] == worker]
+            process = context.Process(
+                target=_worker, args=(self.template, self.rings.spec(), worker_symbols, inbox, self.outbox,
+                      self.batch_minute_bars),
+                name='{}-{}'.format(self.name, worker), daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    # the minute bars the workers hold, read from the shared rings
+    def minute_frames(self):
+        if self.rings is None:
+            return {}
+        return {symbol: buffer.frame()[list(BAR_FIELDS)]
+                for symbol, buffer in self.rings.buffers.items()}
+
+    # queues the bar for its worker and returns None, the bars that arrive together (the burst
+    # on the minute) are sent to each worker as one batch once the event loop is free
+    def on_minute_bar(self, data):
+        worker = self.owners.get(data.symbol)
+        if worker is None:
+            metrics.inc('scanner_symbols_skipped_total', reason='unknown symbol')
+            return None
+        metrics.inc('scanner_bars_processed_total', scan=self.name)
+        if self.pending is None:
+            self.pending = [[] for _ in self.inboxes]
+            asyncio.get_event_loop().call_soon(self.flush)
+        self.pending[worker].append(MinuteBar(data.symbol, data.start, data.open, data.high, data.low,
+                                              data.close, data.volume))
+        return None
+
+    def flush(self):
+        pending, self.pending = self.pending, None
+        for inbox, bars in zip(self.inboxes, pending or ()):
+            if bars:
+                inbox.put(bars)
+
+    # yields (alert frame, bar start) for every alert of the workers until they are stopped
+    async def alerts(self):
+        loop = asyncio.get_event_loop()
+        running = len(self.processes)
+        while running:
+            item = await loop.run_in_executor(None, self.outbox.get)
+            if item is None:
+                running -= 1
+                continue
+            yield item
+
+    # lets the workers finish the bars sent so far, stops them and frees the shared memory
+    async def stop(self):
+        if self.pending is not None:
+            self.flush()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        loop = asyncio.get_event_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+        self.processes = []
+        if self.rings is not None:
+            self.rings.close()
+            self.rings.unlink()
+            self.rings = None
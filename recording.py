@@ -0,0 +1,333 @@
+import asyncio
+import gzip
+import json
+import re
+import threading
+import time
+from datetime import date, datetime
+from datetime import time as clock_time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from bars import BAR_COLUMNS, tz
+
+# records written before the log is flushed to disk
+record_flush_lines = 1000
+
+# fields of an AM (minute bar) message that are recorded
+AM_FIELDS = ('symbol', 'open', 'high', 'low', 'close', 'volume', 'vwap', 'average', 'start', 'end')
+
+
+# A recording is an append-only gzip log of json lines, one per rest response or stream message:
+#   {"t": receive time, "k": "rest", "call": "polygon.historic_agg_v2", "args": {...}, "resp": ...}
+#   {"t": receive time, "k": "am", "channel": "AM.AAPL", "bar": {"symbol": ..., "start": epoch ms, ...}}
+# Every run appends a new gzip member, gzip reads the members back as one stream.
+
+def _json_default(value):
+    if isinstance(value, (datetime, date, clock_time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError('cannot record {!r}'.format(value))
+
+
+def _ms(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(pd.Timestamp(value).value // 10**6)
+
+
+# the fields of an api entity (alpaca / polygon entities keep them in _raw)
+def _fields(entity):
+    raw = getattr(entity, '_raw', None)
+    return dict(raw) if isinstance(raw, dict) else dict(vars(entity))
+
+
+# appends records to a recording, shared by the rest and stream wrappers (and their threads)
+class Recorder:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'at')
+        self.lock = threading.Lock()
+        self.lines = 0
+
+    def write(self, record):
+        record['t'] = time.time()
+        line = json.dumps(record, default=_json_default, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.lines += 1
+            if self.lines % record_flush_lines == 0:
+                self.file.flush()
+
+    def rest(self, call, args, resp):
+        self.write({'k': 'rest', 'call': call, 'args': args, 'resp': resp})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def _frame_fields(df):
+    return {
+        'timestamp': df.index.values.astype('datetime64[ms]').astype('i8').tolist(),
+        **{column: df[column].tolist() for column in BAR_COLUMNS},
+    }
+
+
+# records the polygon responses of a tradeapi.REST().polygon
+class RecordingPolygon:
+
+    def __init__(self, polygon, recorder):
+        self.polygon = polygon
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.polygon, name)
+
+    def all_tickers(self):
+        tickers = self.polygon.all_tickers()
+        self.recorder.rest('polygon.all_tickers', {}, [_fields(ticker) for ticker in tickers])
+        return tickers
+
+    def historic_agg_v2(self, symbol, multiplier, timespan, _from, to, **kwargs):
+        aggs = self.polygon.historic_agg_v2(symbol=symbol, multiplier=multiplier, timespan=timespan,
+                                            _from=_from, to=to, **kwargs)
+        args = {'symbol': symbol, 'multiplier': multiplier, 'timespan': timespan, '_from': _from, 'to': to}
+        self.recorder.rest('polygon.historic_agg_v2', args, _frame_fields(aggs.df))
+        return aggs
+
+
+# records the responses of a tradeapi.REST() the scanners use, everything else is passed through
+class RecordingREST:
+
+    def __init__(self, api, recorder):
+        self.api = api
+        self.recorder = recorder
+        self.polygon = RecordingPolygon(api.polygon, recorder)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def list_assets(self, status=None):
+        assets = self.api.list_assets(status=status)
+        self.recorder.rest('list_assets', {'status': status}, [_fields(asset) for asset in assets])
+        return assets
+
+    def get_calendar(self, start=None, end=None):
+        calendar = self.api.get_calendar(start=start, end=end)
+        self.recorder.rest('get_calendar', {'start': start, 'end': end}, [_fields(day) for day in calendar])
+        return calendar
+
+
+# records the AM messages of a StreamConn before its handlers see them
+class RecordingStream:
+
+    def __init__(self, conn, recorder):
+        self.conn = conn
+        self.recorder = recorder
+        self.last = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def on(self, channel_pat):
+        def register(func):
+            async def handler(conn, channel, data):
+                # a message matching several handlers is recorded once
+                if data is not self.last:
+                    self.last = data
+                    self._record(channel, data)
+                await func(conn, channel, data)
+            self.conn.on(channel_pat)(handler)
+            return func
+        return register
+
+    def _record(self, channel, data):
+        fields = _fields(data)
+        if 'symbol' not in fields or 'start' not in fields:
+            return
+        bar = {field: fields[field] for field in AM_FIELDS if field in fields}
+        bar['start'], bar['end'] = _ms(bar['start']), _ms(bar.get('end'))
+        self.recorder.write({'k': 'am', 'channel': channel, 'bar': bar})
+
+
+# reads every record of a recording in order
+# a run that was killed leaves its last member (and line) cut short, the records before it are kept
+def read_records(path):
+    with gzip.open(path, 'rt') as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                yield record
+        except EOFError:
+            return
+
+
+def _calendar_day(fields):
+    return SimpleNamespace(date=pd.Timestamp(fields['date']), open=pd.Timestamp(fields['open']).time(),
+                           close=pd.Timestamp(fields['close']).time())
+
+
+def _bar_message(bar):
+    fields = dict(bar)
+    fields['start'] = pd.Timestamp(bar['start'], unit='ms', tz=tz)
+    if bar.get('end') is not None:
+        fields['end'] = pd.Timestamp(bar['end'], unit='ms', tz=tz)
+    return SimpleNamespace(**fields)
+
+
+def _aggs(fields):
+    index = pd.to_datetime(fields['timestamp'], unit='ms', utc=True).tz_convert(tz)
+    index.name = 'timestamp'
+    return SimpleNamespace(df=pd.DataFrame({column: fields[column] for column in BAR_COLUMNS}, index=index))
+
+
+def _key(args):
+    return tuple(sorted((name, str(value)) for name, value in args.items()))
+
+
+# a recording loaded for replay: the rest responses by call and arguments and the stream messages
+# in the order they arrived
+class ReplaySource:
+
+    # speed 1 replays the stream in real time, 10 ten times faster, None (or 0) as fast as it is handled
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed or None
+        self.responses = {}
+        self.latest = {}
+        self.messages = []
+        for record in read_records(path):
+            if record['k'] == 'rest':
+                self.responses[(record['call'], _key(record['args']))] = record['resp']
+                self.latest[(record['call'], _key(self._loose_args(record['args'])))] = record['resp']
+            elif record['k'] == 'am':
+                self.messages.append((record['t'], record['channel'], record['bar']))
+        self.rest = ReplayREST(self)
+        self.polygon = self.rest.polygon
+        self.streams = []
+
+    # the history requests depend on the day they run, so a replay on another day is answered with
+    # the latest recorded response for the same symbol and timeframe
+    @staticmethod
+    def _loose_args(args):
+        return {name: value for name, value in args.items() if name not in ('_from', 'to', 'start', 'end')}
+
+    def response(self, call, args):
+        resp = self.responses.get((call, _key(args)))
+        if resp is None:
+            resp = self.latest.get((call, _key(self._loose_args(args))))
+        return resp
+
+    # a new stream connection playing the recorded messages
+    def stream_conn(self):
+        stream = ReplayStream(self)
+        self.streams.append(stream)
+        return stream
+
+    # waits until every stream connection has played all of its messages
+    async def wait(self):
+        while not self.streams or not all(stream.done for stream in self.streams):
+            await asyncio.sleep(.05)
+
+
+class ReplayPolygon:
+
+    def __init__(self, source):
+        self.source = source
+
+    def all_tickers(self):
+        return [SimpleNamespace(**fields) for fields in self.source.response('polygon.all_tickers', {}) or []]
+
+    def historic_agg_v2(self, symbol, multiplier, timespan, _from, to, **kwargs):
+        args = {'symbol': symbol, 'multiplier': multiplier, 'timespan': timespan, '_from': _from, 'to': to}
+        fields = self.source.response('polygon.historic_agg_v2', args)
+        return _aggs(fields or {'timestamp': [], **{column: [] for column in BAR_COLUMNS}})
+
+
+# answers the rest calls of the scanners from a recording instead of the api
+class ReplayREST:
+
+    def __init__(self, source):
+        self.source = source
+        self.polygon = ReplayPolygon(source)
+
+    def list_assets(self, status=None):
+        return [SimpleNamespace(**fields) for fields in self.source.response('list_assets', {'status': status}) or []]
+
+    # the exact range when it was recorded, otherwise every recorded session
+    def get_calendar(self, start=None, end=None):
+        days = self.source.responses.get(('get_calendar', _key({'start': start, 'end': end})))
+        if days is None:
+            days = {}
+            for (call, _), resp in self.source.responses.items():
+                if call == 'get_calendar':
+                    days.update((fields['date'], fields) for fields in resp)
+            days = [days[day] for day in sorted(days)]
+        return [_calendar_day(fields) for fields in days]
+
+
+# plays the recorded AM messages of the subscribed symbols to the handlers, like a StreamConn
+# playing starts with the first subscription, paced by the recorded receive times and the speed
+class ReplayStream:
+
+    def __init__(self, source):
+        self.source = source
+        self.handlers = []
+        self.symbols = set()
+        self.task = None
+        self.done = False
+        self.sent = 0
+
+    def on(self, channel_pat):
+        def register(func):
+            self.handlers.append((re.compile(channel_pat), func))
+            return func
+        return register
+
+    async def subscribe(self, channels):
+        self.symbols.update(channel.partition('.')[2] for channel in channels)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.play())
+
+    async def unsubscribe(self, channels):
+        self.symbols.difference_update(channel.partition('.')[2] for channel in channels)
+
+    async def close(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.done = True
+
+    async def play(self):
+        loop = asyncio.get_event_loop()
+        messages = self.source.messages
+        speed = self.source.speed
+        started = loop.time()
+        first = messages[0][0] if messages else 0
+        try:
+            for t, channel, bar in messages:
+                if bar['symbol'] not in self.symbols:
+                    continue
+                delay = (t - first) / speed - (loop.time() - started) if speed else 0
+                # yield to the loop after every message so the handlers keep up at full speed too
+                await asyncio.sleep(max(delay, 0))
+                data = _bar_message(bar)
+                for pattern, func in self.handlers:
+                    if pattern.match(channel):
+                        await func(self, channel, data)
+                self.sent += 1
+        finally:
+            self.done = True
+
+    # subscribes and plays the recording, like StreamConn.run it blocks until the stream ends
+    def run(self, initial_channels=[]):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.subscribe(initial_channels))
+        loop.run_until_complete(self.task)
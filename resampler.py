@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+from bars import BAR_DTYPE, TIMESPAN_MINUTES, compact_volume, tz
+import metrics
+
+_minute_ms = 60 * 1000
+_day_minutes = 24 * 60
+
+# bucket bounds of this many minute timestamps are cached, the symbols of a minute share them
+bucket_cache_size = 10000
+
+
+# returns the (start, end) epoch ms of the bar of the timeframe each minute bar belongs to and
+# whether it belongs to one, the bars are aligned like polygon's aggregates:
+# - intraday bars are aligned to the ny clock from midnight, pre and post market included, and never
+#   span two days. With a calendar the bar the session closes in ends at the close and the minutes
+#   after it start a new bar
+# - 'day' bars start at ny midnight and, with a calendar, hold the minutes of the regular session
+#   and end at its close (minutes of days without a session belong to no bar)
+def bucket_bounds(timestamps, multiplier, timespan, calendar=None):
+    timestamps = np.asarray(timestamps, dtype='i8')
+    wall = pd.to_datetime(timestamps, unit='ms', utc=True).tz_convert(tz).tz_localize(None).as_unit('ms').asi8
+    offset = wall - timestamps
+    day_ms = _day_minutes * _minute_ms
+    midnight = wall - wall % day_ms
+    minute = (wall % day_ms) // _minute_ms
+    keep = np.ones(len(timestamps), dtype=bool)
+
+    # session open and close of every day as minutes from midnight, -1 without a session
+    opens = np.full(len(timestamps), -1)
+    closes = np.full(len(timestamps), -1)
+    if calendar is not None:
+        days, inverse = np.unique(midnight, return_inverse=True)
+        sessions = np.full((len(days), 2), -1)
+        for i, day in enumerate(days):
+            session = calendar.session(pd.Timestamp(day, unit='ms').date())
+            if session is not None:
+                sessions[i] = [session[0].hour * 60 + session[0].minute, session[1].hour * 60 + session[1].minute]
+        opens, closes = sessions[inverse, 0], sessions[inverse, 1]
+
+    if timespan == 'day':
+        start = np.zeros(len(timestamps), dtype='i8')
+        end = np.where(closes >= 0, closes, _day_minutes)
+        if calendar is not None:
+            keep = (minute >= opens) & (minute < closes)
+    elif timespan in TIMESPAN_MINUTES:
+        step = multiplier * TIMESPAN_MINUTES[timespan]
+        start = minute // step * step
+        end = np.minimum(start + step, _day_minutes)
+        straddles = (start < closes) & (closes < end)
+        end = np.where(straddles & (minute < closes), closes, end)
+        start = np.where(straddles & (minute >= closes), closes, start)
+    else:
+        raise ValueError('{} bars cannot be built from minute bars'.format(timespan))
+
+    return (midnight + start * _minute_ms - offset, midnight + end * _minute_ms - offset, keep)
+
+
+# builds the bars of a timeframe from minute bar records (BAR_DTYPE, oldest first) in one pass
+# the last bar is returned as far as it has formed, like the api returns the current bar
+def resample_records(records, multiplier, timespan, calendar=None):
+    starts, _, keep = bucket_bounds(records['timestamp'], multiplier, timespan, calendar)
+    records, starts = records[keep], starts[keep]
+    bars = np.empty(0 if len(records) == 0 else 1 + np.count_nonzero(starts[1:] != starts[:-1]), dtype=BAR_DTYPE)
+    if len(bars) == 0:
+        return bars
+    first = np.flatnonzero(np.concatenate([[True], starts[1:] != starts[:-1]]))
+    last = np.concatenate([first[1:], [len(records)]]) - 1
+    bars['timestamp'] = starts[first]
+    bars['open'] = records['open'][first]
+    bars['high'] = np.maximum.reduceat(records['high'], first)
+    bars['low'] = np.minimum.reduceat(records['low'], first)
+    bars['close'] = records['close'][last]
+    bars['volume'] = compact_volume(np.add.reduceat(records['volume'].astype(np.uint64), first))
+    return bars
+
+
+def _records(bars):
+    columns = list(zip(*bars))
+    records = np.empty(len(bars), dtype=BAR_DTYPE)
+    for name, values in zip(BAR_DTYPE.names[:-1], columns):
+        records[name] = values
+    records['volume'] = compact_volume(columns[-1])
+    return records
+
+
+# builds the bars of one timeframe incrementally from the minute bars of the stream
+# a bar is complete as soon as the minute bar ending it arrives, bars of symbols without that last
+# minute are completed by flush once their end has passed
+# since (epoch ms) skips the bars that started before it, the minutes of a bar that was already
+# forming when the stream started are not all there
+# a minute that comes in after its bar was completed (or behind the last minute of the forming bar)
+# is not added, the start of its bar is kept in late instead so the bar can be fetched again
+class Resampler:
+
+    def __init__(self, multiplier, timespan, calendar=None, since=None):
+        self.multiplier = multiplier
+        self.timespan = timespan
+        self.calendar = calendar
+        self.since = since
+        # bars ending after the one forming at since are built whole
+        self.whole_from = 0 if since is None else int(bucket_bounds([since], multiplier, timespan, calendar)[1][0])
+        # the forming bar of each symbol: [start, end, open, high, low, close, volume, minute, previous]
+        # previous holds high, low, volume before the last minute so a revision of it can replace it
+        self.forming = {}
+        self.completed = {}
+        # start of the last completed bar of each symbol, minutes of it that come late are dropped
+        self.closed = {}
+        # start of the earliest bar of each symbol a minute came in late for
+        self.late = {}
+        self.buckets = {}
+
+    def _bucket(self, timestamp):
+        bucket = self.buckets.get(timestamp)
+        if bucket is None:
+            if len(self.buckets) >= bucket_cache_size:
+                self.buckets.clear()
+            starts, ends, keep = bucket_bounds([timestamp], self.multiplier, self.timespan, self.calendar)
+            bucket = self.buckets[timestamp] = (int(starts[0]), int(ends[0]), bool(keep[0]))
+        return bucket
+
+    def _complete(self, symbol):
+        bar = self.forming.pop(symbol)
+        self.closed[symbol] = bar[0]
+        self.completed.setdefault(symbol, []).append(tuple(bar[:1] + bar[2:7]))
+
+    def _late(self, symbol, start):
+        metrics.inc('scanner_resampled_late_bars_total')
+        self.late[symbol] = min(start, self.late.get(symbol, start))
+
+    # adds a minute bar (timestamp is its start in epoch ms)
+    def update(self, symbol, timestamp, open, high, low, close, volume):
+        start, end, keep = self._bucket(timestamp)
+        if not keep or (self.since is not None and start < self.since):
+            return
+        bar = self.forming.get(symbol)
+        if bar is not None and bar[0] != start:
+            if start < bar[0]:
+                self._late(symbol, start)
+                return
+            self._complete(symbol)
+            bar = None
+        if bar is None and start <= self.closed.get(symbol, start - 1):
+            self._late(symbol, start)
+            return
+        if bar is None:
+            self.forming[symbol] = bar = [start, end, open, high, low, close, volume, timestamp, None]
+        elif timestamp == bar[7]:
+            # a revision of the last minute replaces it
+            if bar[8] is not None:
+                bar[3], bar[4], bar[6] = bar[8]
+                bar[3], bar[4], bar[6] = max(bar[3], high), min(bar[4], low), bar[6] + volume
+            else:
+                bar[2:7] = [open, high, low, close, volume]
+            bar[5] = close
+        elif timestamp > bar[7]:
+            bar[8] = (bar[3], bar[4], bar[6])
+            bar[3], bar[4], bar[5], bar[6], bar[7] = max(bar[3], high), min(bar[4], low), close, bar[6] + volume, timestamp
+        else:
+            self._late(symbol, start)
+            return
+        if timestamp + _minute_ms >= end:
+            self._complete(symbol)
+
+    # completes the bars that ended by until (epoch ms, every forming bar when None) and returns the
+    # bars completed since the last flush as BAR_DTYPE records by symbol
+    def flush(self, until=None):
+        for symbol in [symbol for symbol, bar in self.forming.items() if until is None or bar[1] <= until]:
+            self._complete(symbol)
+        completed, self.completed = self.completed, {}
+        return {symbol: _records(bars) for symbol, bars in completed.items()}
+
+    # returns the start (epoch ms) of the earliest bar each symbol had a late minute for since the
+    # last call, by symbol
+    def take_late(self):
+        late, self.late = self.late, {}
+        return late
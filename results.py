@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+# rows the column buffers start with, they double whenever they are full
+initial_capacity = 64
+
+
+# collects result rows into preallocated column arrays and builds the frame once at the end
+# adding a row only writes into the arrays (amortized O(1)), so a scan of n symbols costs O(n)
+# instead of the O(n^2) of appending every row to a growing dataframe
+class ResultCollector:
+
+    # dtypes maps a column (or the index) to its numpy dtype, columns default to float64
+    # formats maps a column (or the index) to a function turning the stored array into the one shown
+    # (ex. symbol ids into symbols), so the rows only become strings when the frame is built
+    def __init__(self, columns, index_name=None, dtypes=None, capacity=None, formats=None):
+        self.columns = list(columns)
+        self.index_name = index_name
+        self.formats = formats or {}
+        dtypes = dtypes or {}
+        self.dtypes = {column: np.dtype(dtypes.get(column, np.float64)) for column in self.columns}
+        self.index_dtype = np.dtype(dtypes.get(index_name, object))
+        self.capacity = capacity or initial_capacity
+        self.buffers = {column: np.empty(self.capacity, self.dtypes[column]) for column in self.columns}
+        self.index = np.empty(self.capacity, self.index_dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        self.capacity *= 2
+        for column, buffer in self.buffers.items():
+            self.buffers[column] = np.resize(buffer, self.capacity)
+        self.index = np.resize(self.index, self.capacity)
+
+    # adds a row, values in the order of the columns
+    def add(self, index, *values):
+        if self.size == self.capacity:
+            self._grow()
+        self.index[self.size] = index
+        for column, value in zip(self.columns, values):
+            self.buffers[column][self.size] = value
+        self.size += 1
+
+    def _format(self, name, values):
+        format = self.formats.get(name)
+        return values if format is None else format(values)
+
+    # the rows from start to stop as a dataframe, the arrays are viewed not copied (unless formatted)
+    def frame(self, start=0, stop=None):
+        stop = self.size if stop is None else min(stop, self.size)
+        index = pd.Index(self._format(self.index_name, self.index[start:stop]), name=self.index_name)
+        return pd.DataFrame({column: self._format(column, self.buffers[column][start:stop])
+                             for column in self.columns},
+                            index=index, columns=self.columns, copy=False)
@@ -0,0 +1,153 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+tz = 'America/New_York'
+
+
+# fixed-size ring buffer of bars for one symbol, timestamps are epoch ms
+# every bar is written twice (at i and i + capacity) so the last n bars are always
+# one contiguous slice and can be handed out as views without copying
+class BarRingBuffer:
+
+    def __init__(self, capacity, fields=BAR_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.index = {field: i for i, field in enumerate(fields)}
+        self.timestamps = np.zeros(2 * capacity, dtype='i8')
+        self.data = np.full((len(fields), 2 * capacity), np.nan)
+        self.pos = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # timestamp of the latest bar or None if the buffer is empty
+    @property
+    def last_timestamp(self):
+        if self.size == 0:
+            return None
+        return int(self.timestamps[self.pos - 1 + self.capacity])
+
+    # adds a bar in constant time, a bar with the latest timestamp replaces it and older bars are ignored
+    def append(self, timestamp, *values):
+        last = self.last_timestamp
+        if last is not None and timestamp < last:
+            return
+        if last is not None and timestamp == last:
+            i = (self.pos - 1) % self.capacity
+        else:
+            i = self.pos
+            self.pos = (self.pos + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        self.timestamps[i] = self.timestamps[i + self.capacity] = timestamp
+        self.data[:, i] = self.data[:, i + self.capacity] = values
+
+    # adds the bars of a historic_agg_v2 style dataframe, only the last capacity bars are kept
+    def extend_frame(self, df):
+        df = df.tail(self.capacity)
+        timestamps = df.index.values.astype('datetime64[ms]').astype('i8')
+        values = np.column_stack([df[field].values for field in self.fields])
+        for timestamp, row in zip(timestamps.tolist(), values):
+            self.append(timestamp, *row)
+
+    def _window(self, n):
+        n = self.size if n is None else min(n, self.size)
+        end = self.pos + self.capacity
+        return end - n, end
+
+    # timestamps of the last n bars (view)
+    def last_timestamps(self, n=None):
+        start, end = self._window(n)
+        return self.timestamps[start:end]
+
+    # values of one field for the last n bars (view)
+    def last(self, field, n=None):
+        start, end = self._window(n)
+        return self.data[self.index[field], start:end]
+
+    # all the fields of the last n bars as a (field x bar) array (view)
+    def last_bars(self, n=None):
+        start, end = self._window(n)
+        return self.data[:, start:end]
+
+    # the last n bars as a dataframe indexed by ny time, like the minute history frames
+    def frame(self, n=None):
+        index = pd.to_datetime(self.last_timestamps(n), unit='ms', utc=True).tz_convert(tz)
+        index.name = 'timestamp'
+        return pd.DataFrame(self.last_bars(n).T, index=index, columns=list(self.fields))
+
+
+# builds a ring buffer per symbol seeded with the history frames
+def buffers_from_history(history, capacity, fields=BAR_FIELDS):
+    buffers = {}
+    for symbol, df in history.items():
+        buffers[symbol] = BarRingBuffer(capacity, fields)
+        buffers[symbol].extend_frame(df)
+    return buffers
+
+
+# a BarRingBuffer whose arrays (and position) live in a SharedBarRings block
+class SharedBarRingBuffer(BarRingBuffer):
+
+    def __init__(self, rings, i):
+        self.capacity = rings.capacity
+        self.fields = rings.fields
+        self.index = {field: i for i, field in enumerate(rings.fields)}
+        self.timestamps = rings.timestamps[i]
+        self.data = rings.data[i]
+        self.state = rings.state[i]
+
+    @property
+    def pos(self):
+        return int(self.state[0])
+
+    @pos.setter
+    def pos(self, value):
+        self.state[0] = value
+
+    @property
+    def size(self):
+        return int(self.state[1])
+
+    @size.setter
+    def size(self, value):
+        self.state[1] = value
+
+
+# the ring buffers of many symbols in one shared memory block
+# other processes attach to the block by name, so the bar history is never pickled to them
+# the creating process removes the block (unlink) once the others are done with it
+class SharedBarRings:
+
+    # creates the block, or attaches to the existing one when name is given
+    def __init__(self, symbols, capacity, fields=BAR_FIELDS, name=None):
+        self.symbols = list(symbols)
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        n, width = len(self.symbols), 2 * capacity
+        sizes = (n * width * 8, n * len(self.fields) * width * 8, n * 2 * 8)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=max(sum(sizes), 1))
+        buffer = self.shm.buf
+        self.timestamps = np.ndarray((n, width), dtype='i8', buffer=buffer)
+        self.data = np.ndarray((n, len(self.fields), width), dtype='f8', buffer=buffer, offset=sizes[0])
+        self.state = np.ndarray((n, 2), dtype='i8', buffer=buffer, offset=sizes[0] + sizes[1])
+        if name is None:
+            self.timestamps[:] = 0
+            self.data[:] = np.nan
+            self.state[:] = 0
+        self.buffers = {symbol: SharedBarRingBuffer(self, i) for i, symbol in enumerate(self.symbols)}
+
+    # what another process needs to attach: SharedBarRings(*rings.spec())
+    def spec(self):
+        return self.symbols, self.capacity, self.fields, self.shm.name
+
+    def close(self):
+        self.buffers = {}
+        self.timestamps = self.data = self.state = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,217 @@
+# Command line entry point of the scanners.
+#
+#   python scan.py crossover --once          scan the latest hourly bars now and exit
+#   python scan.py crossover --live          scan on every hourly bar close (the default mode)
+#   python scan.py volume_pop --once         scan the daily bars for volume pops now and exit
+#   python scan.py momentum --live           evaluate the live minute bars
+#   python scan.py leaders --live            keep the top movers of the minute bars, digest every --digest seconds
+#   python scan.py all --live --discord      every strategy on one engine, alerts posted to discord
+#   python scan.py crossover --backtest      every crossover of the last --days days and its returns
+#
+# Only the modules a mode uses are imported and the api / discord clients are created on first
+# use (see clients.py), so --help or a dry --once does not pay for the streaming or discord stack.
+# --warm starts from the snapshot of the last run (universe, indicator states, minute bars) and
+# keeps saving it, so a restart is scanning without waiting on the full history fetch.
+# --live builds the bars of the crossover from the minute stream once the history is stored (see
+# resampler.py), so the hourly scans do not ask the api for every symbol again.
+# --record appends every api response and minute bar to a log, --replay runs the scanners on a
+# log instead of the api (at --speed times real time, as fast as possible by default) and exits
+# once the recorded stream has been played.
+import argparse
+import asyncio
+
+strategy_names = ('crossover', 'volume_pop', 'momentum', 'leaders', 'all')
+
+
+def build_strategies(name, workers=None, digest=None):
+    from strategies import CrossoverStrategy, MomentumStrategy, VolumePopStrategy
+    strategies = []
+    if name in ('crossover', 'all'):
+        strategies.append(CrossoverStrategy())
+    if name in ('volume_pop', 'all'):
+        strategies.append(VolumePopStrategy())
+    if name in ('momentum', 'all'):
+        strategy = MomentumStrategy()
+        if workers:
+            from parallel import ParallelStrategy
+            strategy = ParallelStrategy(strategy, workers)
+        strategies.append(strategy)
+    if name in ('leaders', 'all'):
+        from leaderboard import Leaderboard
+        strategies.append(Leaderboard(digest_seconds=digest))
+    return strategies
+
+
+def build_alerts(args):
+    from alerts import AlertDispatcher, DiscordSink, MemorySink
+    import clients
+    if args.discord:
+        return AlertDispatcher(DiscordSink(clients.discord_client(), clients.discord_channel_id()))
+    return AlertDispatcher(MemorySink())
+
+
+def build_engine(args, alerts):
+    from engine import ScannerEngine
+    import clients
+    engine = ScannerEngine(clients.rest(), alerts)
+    for strategy in build_strategies(args.strategy, args.workers, args.digest):
+        engine.add(strategy)
+    if args.warm:
+        from snapshot import load_snapshot
+        load_snapshot(engine, args.snapshot)
+    return engine
+
+
+# runs the bar strategies once and exits once the alerts are sent
+def run_once(args):
+    alerts = build_alerts(args)
+    engine = build_engine(args, alerts)
+
+    async def scan():
+        await engine.run_once()
+        await alerts.flush()
+        if args.warm:
+            from snapshot import save_snapshot
+            save_snapshot(engine, args.snapshot)
+
+    if not args.discord:
+        asyncio.run(scan())
+        return
+    import clients
+    client = clients.discord_client()
+
+    async def on_ready():
+        try:
+            await scan()
+        finally:
+            await client.close()
+    client.event(on_ready)
+    client.run(clients.discord_token())
+
+
+# runs the scheduled scans and the minute stream until stopped
+def run_live(args):
+    import clients
+    from sharding import ShardedStream
+    from stream import StreamRunner
+    clients.configure_metrics()
+    alerts = build_alerts(args)
+    engine = build_engine(args, alerts)
+    conn = None
+    if engine.needs_stream():
+        conn = StreamRunner(engine.api, lambda: ShardedStream(clients.stream_conn, args.shards))
+    # a replayed stream ends, the scans of the bars are replayed with --once
+    replaying = clients.replay_path and conn is not None
+
+    async def start(loop):
+        await engine.start(loop, conn)
+        if args.warm:
+            from snapshot import save_every
+            loop.create_task(save_every(engine, path=args.snapshot))
+        print('Engine is ready and scanning...')
+        if replaying:
+            await clients.replay_source().wait()
+            engine.flush_minute_bars()
+            await alerts.flush()
+            print('Replayed {} bars'.format(sum(stream.sent for stream in clients.replay_source().streams)))
+
+    try:
+        if args.discord:
+            client = clients.discord_client()
+
+            async def on_ready():
+                await start(client.loop)
+            client.event(on_ready)
+            client.run(clients.discord_token())
+        else:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(start(loop))
+            if not replaying:
+                loop.run_forever()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+    finally:
+        if args.warm:
+            from snapshot import save_snapshot
+            save_snapshot(engine, args.snapshot)
+
+
+# backtests the crossover over the stored hourly bars and writes the signals to a csv
+def run_backtest(args):
+    from datetime import datetime, timedelta
+    from tabulate import tabulate
+    from backtest import backtest_crossovers, summarize
+    from bar_store import BarStore
+    from universe import Universe
+    import clients
+    strategy = build_strategies('crossover')[0]
+    api = clients.rest()
+    store = BarStore()
+    now = datetime.now()
+    _from = (now - timedelta(days=args.days)).strftime('%Y-%m-%d')
+
+    symbols = Universe(api).filter(**strategy.universe)
+    print('Getting historical data...')
+    symbols = store.refresh(api, symbols, multiplier=strategy.multiplier, timespan=strategy.timespan,
+                            _from=_from, to=now.strftime('%Y-%m-%d'))
+    print('Backtesting {} symbols...'.format(len(symbols)))
+    signals_df = backtest_crossovers(symbols, strategy.sma_fast, strategy.sma_slow, strategy.price_change_threshold,
+                                     _from=_from, store=store, workers=args.workers)
+    signals_df.to_csv(args.output, index=False)
+    print('{} signals written to {}'.format(len(signals_df), args.output))
+    print(tabulate(summarize(signals_df), headers='keys', tablefmt='github', floatfmt=",.2f"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='scan', description='run the tag scanners')
+    parser.add_argument('strategy', choices=strategy_names)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', dest='mode', action='store_const', const='once',
+                      help='scan the latest bars now and exit')
+    mode.add_argument('--live', dest='mode', action='store_const', const='live',
+                      help='scan on every bar close and follow the minute stream (default)')
+    mode.add_argument('--backtest', dest='mode', action='store_const', const='backtest',
+                      help='evaluate every crossover of the last --days days')
+    parser.add_argument('--discord', action='store_true', help='post the alerts to discord instead of printing them')
+    parser.add_argument('--warm', action='store_true', help='start from the saved snapshot and keep saving it')
+    parser.add_argument('--snapshot', help='snapshot file (defaults to SCANNER_SNAPSHOT or scanner_snapshot.pkl)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for the minute bars and the backtest')
+    parser.add_argument('--shards', type=int, default=None, help='streaming connections')
+    parser.add_argument('--digest', type=float, default=None,
+                        help='seconds between the top movers digests (0 for none)')
+    parser.add_argument('--days', type=int, default=365, help='days the backtest runs over')
+    parser.add_argument('--output', default='crossover_backtest.csv', help='csv the backtest signals go to')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--record', help='append every api response and minute bar to this log')
+    source.add_argument('--replay', help='serve the api and the minute stream from this log')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay speed, 1 for real time (default as fast as possible)')
+    args = parser.parse_args(argv)
+    args.mode = args.mode or 'live'
+
+    if args.mode == 'once' and args.strategy in ('momentum', 'leaders'):
+        parser.error('{} only runs on the live minute stream'.format(args.strategy))
+    if args.mode == 'backtest' and args.strategy != 'crossover':
+        parser.error('only the crossover can be backtested')
+
+    import clients
+    clients.record_path = args.record or clients.record_path
+    clients.replay_path = args.replay or clients.replay_path
+    clients.replay_speed = args.speed
+    if clients.replay_path:
+        # the recorded responses are not rate limited
+        import fetcher
+        fetcher.requests_per_second = 1e9
+    try:
+        {'once': run_once, 'live': run_live, 'backtest': run_backtest}[args.mode](args)
+    finally:
+        clients.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from alerts import AlertDispatcher, DiscordSink, MemorySink
+from engine import ScannerEngine
+from sharding import ShardedStream
+from stream import StreamRunner
+from parallel import ParallelStrategy
+import clients
+from strategies import CrossoverStrategy, MomentumStrategy
+
+# Discord 
+postToDiscord = True
+
+# worker processes the minute bars are evaluated on, None evaluates them on the event loop
+eval_workers = None
+
+
+# the api and discord clients are only created here, so the module can be imported without connecting
+def main():
+    api = clients.rest()
+    client = clients.discord_client()
+
+    # prometheus text endpoint and / or a periodic json metrics line (METRICS_PORT, METRICS_LOG_INTERVAL)
+    clients.configure_metrics()
+
+    # the streaming connections shared by all the minute bar strategies, the symbols are split across them
+    # the runner reconnects them and backfills the bars missed meanwhile
+    conn = StreamRunner(api, lambda: ShardedStream(clients.stream_conn))
+
+    # alerts are queued and sent from their own task so scanning never waits on discord
+    alerts = AlertDispatcher(DiscordSink(client, clients.discord_channel_id()) if postToDiscord else MemorySink())
+
+    # all the scans run from one engine, so the universe and market data are loaded once
+    engine = ScannerEngine(api, alerts)
+    engine.add(CrossoverStrategy())
+    engine.add(ParallelStrategy(MomentumStrategy(), eval_workers) if eval_workers else MomentumStrategy())
+
+    @client.event
+    async def on_ready():
+        await engine.start(client.loop, conn)
+        print('Engine is ready and scanning...')
+
+    client.run(clients.discord_token())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta, time
+from pytz import timezone
+from resampler import bucket_bounds
+
+nyc = timezone('America/New_York')
+
+# regular session used when no trading calendar is available
+session_open = time(9, 30)
+session_close = time(16, 0)
+
+# days of the exchange calendar fetched at a time
+calendar_days = 60
+
+
+# exchange sessions by date, taken from the alpaca calendar (holidays and early closes included)
+# without an api every weekday that is not in holidays gets the regular session
+class TradingCalendar:
+
+    def __init__(self, api=None, holidays=()):
+        self.api = api
+        self.holidays = set(holidays)
+        self.sessions = {}
+        self.loaded_from = None
+        self.loaded_until = None
+
+    def _load(self, day):
+        end = day + timedelta(days=calendar_days)
+        for entry in self.api.get_calendar(start=day.isoformat(), end=end.isoformat()):
+            self.sessions[entry.date.date()] = (entry.open, entry.close)
+        self.loaded_from = day
+        self.loaded_until = end
+
+    # returns the (open, close) ny datetimes of the session on a date or None if the market is closed
+    def session(self, day):
+        if self.api is not None:
+            if self.loaded_from is None or not self.loaded_from <= day <= self.loaded_until:
+                self._load(day)
+            hours = self.sessions.get(day)
+        elif day.weekday() < 5 and day not in self.holidays:
+            hours = (session_open, session_close)
+        else:
+            hours = None
+        if hours is None:
+            return None
+        return nyc.localize(datetime.combine(day, hours[0])), nyc.localize(datetime.combine(day, hours[1]))
+
+
+# returns the close time of the next bar of the timeframe that closes after the given time
+# the bars are the ones resampler.bucket_bounds builds: intraday bars are aligned to the clock like
+# polygon's aggregates, the last bar of a session closes with the session, 'day' bars close at the
+# session close
+def next_bar_close(calendar, multiplier, timespan, after):
+    after = after.astimezone(nyc)
+    day = after.date()
+    for _ in range(14):
+        session = calendar.session(day)
+        if session is not None:
+            open_time, close_time = session
+            if timespan == 'day':
+                candidate = close_time
+            else:
+                start = max(after, open_time)
+                end = bucket_bounds([int(start.timestamp() * 1000)], multiplier, timespan, calendar)[1][0]
+                candidate = min(datetime.fromtimestamp(end / 1000, nyc), close_time)
+            if candidate > after:
+                return candidate
+        day += timedelta(days=1)
+    return None
+
+
+# fires callbacks when bars of their timeframe close (plus a settle delay so the data is in)
+# all the registered timeframes share one timer, the next job due is kept at the top of a heap
+class BarCloseScheduler:
+
+    def __init__(self, calendar=None):
+        self.calendar = calendar or TradingCalendar()
+        self.jobs = []
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = None
+
+    # registers an async callback(bar_close) for every bar close of the timeframe
+    def every(self, multiplier, timespan, callback, settle=0):
+        job = (multiplier, timespan, callback, timedelta(seconds=settle))
+        self.jobs.append(job)
+        self._schedule(job, datetime.now(nyc))
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return job
+
+    def _schedule(self, job, after):
+        multiplier, timespan, callback, settle = job
+        close_time = next_bar_close(self.calendar, multiplier, timespan, after)
+        if close_time is not None:
+            heapq.heappush(self.heap, (close_time + settle, next(self.counter), close_time, job))
+
+    async def _fire(self, callback, close_time):
+        try:
+            await callback(close_time)
+        except Exception as e:
+            print('Scheduled scan for {} failed: {}'.format(close_time, e))
+
+    # runs the timer, each callback runs as its own task so a slow scan does not delay the others
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            if not self.heap:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            fire_time, _, close_time, job = self.heap[0]
+            delay = (fire_time - datetime.now(nyc)).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                    self.wakeup.clear()
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            asyncio.ensure_future(self._fire(job[2], close_time))
+            self._schedule(job, close_time)
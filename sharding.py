@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import math
+import multiprocessing
+import time
+import zlib
+import metrics
+
+# streaming connections the symbols are split across
+stream_shards = 4
+
+# seconds between the rebalances of the engine's sharded stream, None to never rebalance
+rebalance_interval = 600
+
+# shards are rebalanced once their message rates differ by more than this share of the average
+rebalance_tolerance = .1
+
+# seconds the measured message rates look back over (time constant of their exponential decay)
+rate_window = 300
+
+
+# the shard a symbol goes to when nothing is known about its message rate
+# crc32 is stable across processes and runs, unlike hash()
+def shard_of(symbol, shards):
+    return zlib.crc32(symbol.encode()) % shards
+
+
+# splits the symbols into shards, by crc32 or, when rates are given, so that every shard gets about
+# the same message rate (heaviest symbols first onto the lightest shard, symbols without a rate
+# count as the average rate)
+# the same symbols and rates always give the same shards
+def assign_shards(symbols, shards, rates=None):
+    if not rates:
+        return {symbol: shard_of(symbol, shards) for symbol in symbols}
+    known = [rates[symbol] for symbol in symbols if symbol in rates]
+    default = sum(known) / len(known) if known else 1.0
+    weighted = sorted(((rates.get(symbol, default), symbol) for symbol in symbols), key=lambda x: (-x[0], x[1]))
+    loads = [(0.0, shard) for shard in range(shards)]
+    assignment = {}
+    for rate, symbol in weighted:
+        load, shard = heapq.heappop(loads)
+        assignment[symbol] = shard
+        heapq.heappush(loads, (load + rate, shard))
+    return assignment
+
+
+# moves as few symbols as it takes from the busiest shards to the quietest ones until the message
+# rates of the shards are within tolerance of each other, returns the new assignment
+def rebalance_shards(assignment, shards, rates, tolerance=None):
+    tolerance = rebalance_tolerance if tolerance is None else tolerance
+    assignment = dict(assignment)
+    loads = [0.0] * shards
+    members = [[] for _ in range(shards)]
+    for symbol, shard in assignment.items():
+        loads[shard] += rates.get(symbol, 0.0)
+        members[shard].append(symbol)
+    limit = tolerance * sum(loads) / shards
+    for _ in range(len(assignment)):
+        busiest = max(range(shards), key=loads.__getitem__)
+        quietest = min(range(shards), key=loads.__getitem__)
+        gap = loads[busiest] - loads[quietest]
+        if gap <= limit:
+            break
+        # the symbol that brings the two shards closest together
+        candidates = [symbol for symbol in members[busiest] if 0 < rates.get(symbol, 0.0) < gap]
+        if not candidates:
+            break
+        symbol = min(candidates, key=lambda s: (abs(gap / 2 - rates[s]), s))
+        members[busiest].remove(symbol)
+        members[quietest].append(symbol)
+        loads[busiest] -= rates[symbol]
+        loads[quietest] += rates[symbol]
+        assignment[symbol] = quietest
+    return assignment
+
+
+# exponentially decayed messages per second of every symbol
+class MessageRates:
+
+    def __init__(self, window=None):
+        self.decay = 1.0 / (window or rate_window)
+        self.counts = {}
+        self.updated = {}
+
+    def record(self, symbol, now=None):
+        now = time.monotonic() if now is None else now
+        last = self.updated.get(symbol)
+        count = self.counts.get(symbol, 0.0)
+        if last is not None:
+            count *= math.exp(-(now - last) * self.decay)
+        self.counts[symbol] = count + 1
+        self.updated[symbol] = now
+
+    # messages per second of every symbol seen
+    def rates(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {symbol: count * math.exp(-(now - self.updated[symbol]) * self.decay) * self.decay
+                for symbol, count in self.counts.items()}
+
+
+# splits 'EV.SYMBOL' channels into (ev, symbol)
+def _split(channel):
+    ev, _, symbol = channel.partition('.')
+    return ev, symbol
+
+
+# several streaming connections that look like one StreamConn (on / subscribe / run / close)
+# the channels of a symbol always go to the same connection, so a socket only carries its share
+# of the messages; the handlers are registered on every connection
+class ShardedStream:
+
+    # connect is called once per shard and returns a new StreamConn
+    def __init__(self, connect, shards=None):
+        self.shards = shards or stream_shards
+        self.connect = connect
+        self.connections = [connect() for _ in range(self.shards)]
+        self.handlers = []
+        self.rates = MessageRates()
+        self.assignment = {}
+        self.channels = {}
+
+    def on(self, channel_pat):
+        def register(func):
+            async def handler(conn, channel, data):
+                symbol = getattr(data, 'symbol', None)
+                if symbol is not None:
+                    self.rates.record(symbol)
+                await func(conn, channel, data)
+            self.handlers.append((channel_pat, handler))
+            for conn in self.connections:
+                conn.on(channel_pat)(handler)
+            return func
+        return register
+
+    # subscribes every channel on the connection of its symbol
+    # rates (messages per second by symbol) balances a first subscription, later ones use the
+    # rates measured on the stream
+    async def subscribe(self, channels, rates=None):
+        symbols = [symbol for symbol in dict.fromkeys(_split(channel)[1] for channel in channels)
+                   if symbol not in self.assignment]
+        self.assignment.update(assign_shards(symbols, self.shards, rates or self.rates.rates()))
+        by_shard = {}
+        for channel in channels:
+            symbol = _split(channel)[1]
+            self.channels.setdefault(symbol, set()).add(channel)
+            by_shard.setdefault(self.assignment[symbol], []).append(channel)
+        await asyncio.gather(*(self.connections[shard].subscribe(shard_channels)
+                               for shard, shard_channels in by_shard.items()))
+        for shard, shard_channels in by_shard.items():
+            metrics.inc('scanner_stream_subscriptions_total', len(shard_channels), shard=shard)
+
+    # moves the fewest symbols between the connections that balances the measured message rates
+    # the new connection subscribes before the old one drops the channels, so no bar is missed
+    # (a bar that arrives on both is replaced in the ring buffer, not added twice)
+    async def rebalance(self):
+        rates = self.rates.rates()
+        if not rates:
+            return 0
+        assignment = rebalance_shards(self.assignment, self.shards, rates)
+        moved = [symbol for symbol, shard in assignment.items() if shard != self.assignment[symbol]]
+        subscribe, unsubscribe = {}, {}
+        for symbol in moved:
+            channels = sorted(self.channels.get(symbol, ()))
+            subscribe.setdefault(assignment[symbol], []).extend(channels)
+            unsubscribe.setdefault(self.assignment[symbol], []).extend(channels)
+        await asyncio.gather(*(self.connections[shard].subscribe(channels) for shard, channels in subscribe.items()))
+        await asyncio.gather(*(self.connections[shard].unsubscribe(channels)
+                               for shard, channels in unsubscribe.items()))
+        self.assignment = assignment
+        return len(moved)
+
+    # rebalances the connections every interval seconds
+    async def rebalance_every(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            moved = await self.rebalance()
+            if moved:
+                print('Moved {} symbols between stream connections'.format(moved))
+
+    # the symbols on the connection of a shard
+    def symbols_of(self, shard):
+        return [symbol for symbol, assigned in self.assignment.items() if assigned == shard]
+
+    # replaces the connection of one shard (a socket that died or went quiet) with a new one on the
+    # same channels, the other connections keep running, returns the new connection
+    async def reconnect(self, shard):
+        old = self.connections[shard]
+        try:
+            await old.close()
+        except Exception as e:
+            print('Error closing stream shard {}: '.format(shard), e)
+        conn = self.connections[shard] = self.connect()
+        for channel_pat, handler in self.handlers:
+            conn.on(channel_pat)(handler)
+        channels = [channel for symbol in self.symbols_of(shard) for channel in sorted(self.channels.get(symbol, ()))]
+        if channels:
+            await conn.subscribe(channels)
+        return conn
+
+    async def close(self):
+        await asyncio.gather(*(conn.close() for conn in self.connections), return_exceptions=True)
+
+    # subscribes the channels and runs all the connections on one event loop until it is stopped
+    def run(self, initial_channels=[]):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.subscribe(initial_channels))
+        loop.run_forever()
+
+
+# runs target(symbols) for every shard of the symbols in its own process, so the message parsing
+# and the strategy work of the shards use separate cores, and waits for all of them
+def run_shard_processes(target, symbols, shards=None, rates=None):
+    shards = shards or stream_shards
+    assignment = assign_shards(symbols, shards, rates)
+    processes = []
+    for shard in range(shards):
+        shard_symbols = [symbol for symbol in symbols if assignment[symbol] == shard]
+        if not shard_symbols:
+            continue
+        process = multiprocessing.Process(target=target, args=(shard_symbols,), name='shard-{}'.format(shard))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import pickle
+import time
+from bars import frame_to_records, records_to_frame
+
+# file the warm start snapshot of the engine is kept in
+snapshot_path = os.getenv('SCANNER_SNAPSHOT', 'scanner_snapshot.pkl')
+
+# a snapshot older than this many seconds is not loaded
+snapshot_max_age = 12 * 60 * 60
+
+# seconds between the snapshots saved while the engine runs
+snapshot_interval = 300
+
+
+# saves what a restarted engine needs to scan at once: the universe, the indicator states of the
+# bar strategies, the minute bars of the stream strategies and the alerts already sent
+def save_snapshot(engine, path=None):
+    path = path or snapshot_path
+    state = {
+        'time': time.time(),
+        'universe': engine.universe.state(),
+        'states': {strategy.name: strategy.states for strategy in engine.bar_strategies()
+                   if hasattr(strategy, 'states')},
+        'minute_history': {symbol: frame_to_records(df) for symbol, df in engine.minute_frames().items()},
+        'alerts': engine.alert_state.state(),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# restores the engine from the snapshot, returns False when there is none or it is too old
+def load_snapshot(engine, path=None, max_age=None):
+    path = path or snapshot_path
+    max_age = snapshot_max_age if max_age is None else max_age
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    age = time.time() - state['time']
+    if age > max_age:
+        print('Snapshot is {:.0f}s old, starting cold'.format(age))
+        return False
+
+    engine.universe.restore(state['universe'], age)
+    for strategy in engine.bar_strategies():
+        if hasattr(strategy, 'states'):
+            strategy.states.update(state['states'].get(strategy.name, {}))
+    engine.alert_state.restore(state.get('alerts', ()))
+    engine.warm_history = {symbol: records_to_frame(records) for symbol, records in state['minute_history'].items()}
+    print('Warm start from a {:.0f}s old snapshot'.format(age))
+    return True
+
+
+# saves the snapshot every interval seconds
+async def save_every(engine, interval=None, path=None):
+    while True:
+        await asyncio.sleep(interval or snapshot_interval)
+        try:
+            save_snapshot(engine, path)
+        except Exception as e:
+            print('Failed to save the snapshot: ', e)
@@ -0,0 +1,301 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from bar_store import timeframe_key
+from crossover import scan_crossover_states
+from heikin_ashi import HA_FIELDS, HeikinAshiState, add_heikin_ashi
+from ring_buffer import BAR_FIELDS, buffers_from_history, tz
+from volume_pop import scan_volume_pops
+import metrics
+
+# Strategies are plain objects the scanner engine feeds with market data.
+# Every strategy has a name, the alert title, the tabulate options of its alert table and the
+# universe filter it scans (kwargs of Universe.filter).
+# Bar strategies scan the stored bars of one timeframe when a bar closes:
+#   multiplier, timespan, lookback and scan(bars, symbols) -> results dataframe
+# Stream strategies evaluate the live minute bars:
+#   history_from(), seed(history) and on_minute_bar(data) -> alert dataframe or None
+#   and optionally on_minute_bars(bars) -> [(alert dataframe, bar start)] for a batch of bars
+#   and alert_filter, set to a callable (key, bar, level, move) -> bool the strategy drops the
+#   repeated alerts with before it builds their dataframes
+
+
+# 13/30 moving average crossover on hourly bars, with indicator state kept between scans
+class CrossoverStrategy:
+
+    name = 'crossover'
+    title = '13/30 Moving Average Crossover - ALERT:'
+    floatfmt = (",.2f", ",.2f", ",.2f", ",.2f", ",.2f", ",.2f", ",.0f")
+    showindex = False
+
+    def __init__(self, sma_fast=13, sma_slow=30, price_change_threshold=.10,
+                 min_share_price=5.0, min_volume=2000000, multiplier=60, timespan='minute', lookback_days=7):
+        self.sma_fast = sma_fast
+        self.sma_slow = sma_slow
+        self.price_change_threshold = price_change_threshold
+        self.universe = {'min_price': min_share_price, 'min_volume': min_volume}
+        self.multiplier = multiplier
+        self.timespan = timespan
+        self.lookback = timedelta(days=lookback_days)
+        self.states = {}
+
+    @property
+    def timeframe(self):
+        return timeframe_key(self.multiplier, self.timespan)
+
+    # bars is a dict of stored bar records by symbol
+    def scan(self, bars, symbols):
+        _from = (datetime.now() - self.lookback).strftime('%Y-%m-%d')
+        results_df = scan_crossover_states(
+            self.states, bars, self.sma_fast, self.sma_slow, self.price_change_threshold, _from, symbols
+        )
+        # the alert table shows the bar time as its first column
+        return results_df.reset_index()
+
+    # (key, bar, level, move) of every alert row, for the alert state (see alerts.AlertState)
+    # a cross the other way is a new alert, a repeat of one needs a larger move
+    def alert_keys(self, results_df):
+        return [((symbol, direction), timestamp, None, perc_change) for timestamp, symbol, direction, perc_change in
+                zip(results_df['timestamp'], results_df['symbol'], results_df['dir'], results_df['perc_change'])]
+
+
+# daily volume pop: the eval days trade a multiple of the trend days' average volume on a price move
+class VolumePopStrategy:
+
+    name = 'volume_pop'
+    title = 'Daily Volume Pop - ALERT:'
+    floatfmt = (",.2f", ",.2f", ",.2f", ",.2f", ",.0f", ",.0f", ",.1f")
+    showindex = False
+
+    def __init__(self, trend_bar_count=10, eval_bar_count=2, vol_pop_multiplier=5, price_change_threshold=.10,
+                 min_share_price=.50, min_volume=2000000):
+        self.trend_bar_count = trend_bar_count
+        self.eval_bar_count = eval_bar_count
+        self.vol_pop_multiplier = vol_pop_multiplier
+        self.price_change_threshold = price_change_threshold
+        self.universe = {'min_price': min_share_price, 'min_volume': min_volume}
+        self.multiplier = 1
+        self.timespan = 'day'
+        # calendar days holding the trend and eval sessions, weekends and holidays included
+        self.lookback = timedelta(days=(trend_bar_count + eval_bar_count) * 7 // 5 + 7)
+
+    @property
+    def timeframe(self):
+        return timeframe_key(self.multiplier, self.timespan)
+
+    # bars is a dict of stored bar records by symbol
+    def scan(self, bars, symbols):
+        results_df = scan_volume_pops(bars, self.trend_bar_count, self.eval_bar_count, self.vol_pop_multiplier,
+                                      self.price_change_threshold, symbols)
+        # the alert table shows the bar date as its first column
+        return results_df.reset_index()
+
+    # (key, bar, level, move) of every alert row, a repeat needs a bigger pop or a larger move
+    def alert_keys(self, results_df):
+        return list(zip(results_df['symbol'], results_df['timestamp'], results_df['volume_factor'],
+                        results_df['perc_change']))
+
+
+# 1 minute price momentum: the eval bars break out above the trend bars on volume
+class MomentumStrategy:
+
+    name = 'momentum'
+    title = 'Price Momentum Alert:'
+    floatfmt = 'g'
+    showindex = True
+
+    def __init__(self, trend_bar_count=10, eval_bar_count=1, price_percentage_threshold=5,
+                 minimum_bar_volume=2000, min_share_price=.50, max_share_price=20,
+                 minimum_daily_volume=100000, history_margin_bars=5):
+        self.trend_bar_count = trend_bar_count
+        self.eval_bar_count = eval_bar_count
+        self.price_percentage_threshold = price_percentage_threshold
+        self.minimum_bar_volume = minimum_bar_volume
+        self.history_margin_bars = history_margin_bars
+        self.universe = {'min_price': min_share_price, 'max_price': max_share_price,
+                         'min_volume': minimum_daily_volume}
+        self.capacity = trend_bar_count + eval_bar_count + history_margin_bars
+        self.fields = BAR_FIELDS + HA_FIELDS
+        self.minute_history = {}
+        self.ha_states = {}
+        self.alert_filter = None
+
+    # start of the minute history the strategy is seeded with
+    def history_from(self):
+        return (datetime.now() - timedelta(minutes=30)).strftime('%Y-%m-%d')
+
+    # seeds the ring buffers (with Heiken Ashi bars) and the streaming Heiken Ashi states
+    # the buffers are the ones of shared rings (see ring_buffer.SharedBarRings) when given
+    def seed(self, history, rings=None):
+        for symbol, df in history.items():
+            df = add_heikin_ashi(df.copy())
+            self.ha_states[symbol] = HeikinAshiState.from_frame(df)
+            history[symbol] = df
+        if rings is None:
+            self.minute_history.update(buffers_from_history(history, self.capacity, self.fields))
+            return
+        for symbol, df in history.items():
+            rings.buffers[symbol].extend_frame(df)
+            self.minute_history[symbol] = rings.buffers[symbol]
+
+    # takes over the symbols of shared rings seeded by another process
+    def attach(self, rings, symbols):
+        for symbol in symbols:
+            buffer = rings.buffers[symbol]
+            self.minute_history[symbol] = buffer
+            self.ha_states[symbol] = HeikinAshiState.from_frame(buffer.frame(2))
+
+    # the minute bars held for every symbol, for a warm start (see snapshot.py)
+    def minute_frames(self):
+        return {symbol: buffer.frame()[list(BAR_FIELDS)] for symbol, buffer in self.minute_history.items()}
+
+    # (key, bar, level, move) of an alert frame, a repeat needs a new high or a larger move
+    def alert_keys(self, alert_df):
+        last = alert_df.iloc[-1]
+        return [(last['symbol'], alert_df.index[-1], last['close'], last['%_price_change'])]
+
+    # adds an AM bar to the symbol's history and returns the alert frame if it breaks out
+    def on_minute_bar(self, data):
+
+        # ignore symbols whose history could not be fetched
+        if data.symbol not in self.minute_history:
+            metrics.inc('scanner_symbols_skipped_total', reason='unknown symbol')
+            return None
+        metrics.inc('scanner_bars_processed_total', scan='momentum')
+        with metrics.timer('indicators'):
+            return self._evaluate(data)
+
+    # adds a batch of AM bars (the burst on the minute) and returns (alert frame, bar start) for each
+    # that breaks out, the symbols are evaluated together on their (symbol x bar) close and volume
+    # arrays and only the alerting ones get a dataframe
+    # a symbol with a second bar in the batch is evaluated before it is added, so every bar is
+    # evaluated like on_minute_bar would
+    def on_minute_bars(self, bars):
+        alerts = []
+        pending = {}
+        processed = 0
+        with metrics.timer('indicators'):
+            for data in bars:
+                if data.symbol in pending:
+                    alerts.extend(self._evaluate_batch(pending))
+                    pending = {}
+                if data.symbol not in self.minute_history:
+                    metrics.inc('scanner_symbols_skipped_total', reason='unknown symbol')
+                    continue
+                processed += 1
+                if self._append(data):
+                    pending[data.symbol] = data.start
+            alerts.extend(self._evaluate_batch(pending))
+        metrics.inc('scanner_bars_processed_total', processed, scan='momentum')
+        return alerts
+
+    # adds the new bar data and its Heiken Ashi bar to the minute history buffer
+    # returns False for a bar older than the latest one, which is ignored
+    def _append(self, data):
+        ts = data.start
+        ts -= timedelta(microseconds=ts.microsecond)
+        ts = int(round(ts.timestamp() * 1000))
+        buffer = self.minute_history[data.symbol]
+        if buffer.last_timestamp is not None and ts < buffer.last_timestamp:
+            return False
+        ha_bar = self.ha_states[data.symbol].update(
+            data.open, data.high, data.low, data.close, replace=ts == buffer.last_timestamp
+        )
+        buffer.append(ts, data.open, data.high, data.low, data.close, data.volume, *ha_bar)
+        return True
+
+    def _evaluate(self, data):
+        if not self._append(data):
+            return None
+        return self._evaluate_frame(data.symbol)
+
+    # the test of _evaluate_frame for many symbols at once, pending maps the symbols to their bar start
+    def _evaluate_batch(self, pending):
+        window = self.trend_bar_count + self.eval_bar_count
+        full = [symbol for symbol in pending if len(self.minute_history[symbol]) >= window]
+        alerts = []
+        # a symbol with a shorter history than the window takes the dataframe path
+        for symbol in pending:
+            if len(self.minute_history[symbol]) < window:
+                alert_df = self._evaluate_frame(symbol)
+                if alert_df is not None:
+                    alerts.append((alert_df, pending[symbol]))
+        if not full:
+            return alerts
+
+        close = np.array([self.minute_history[symbol].last('close', window) for symbol in full])
+        volume = np.array([self.minute_history[symbol].last('volume', window) for symbol in full])
+        eval_close = close[:, -self.eval_bar_count:]
+        prev_close = close[:, -self.eval_bar_count - 1:-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend_price_max = np.fmax.reduce(close[:, :self.trend_bar_count], axis=1)
+            eval_perc_price_change_avg = ((eval_close - prev_close) / prev_close * 100).mean(axis=1)
+        breakouts = ((eval_close.mean(axis=1) > trend_price_max) &
+                     (volume[:, -self.eval_bar_count:].mean(axis=1) > self.minimum_bar_volume) &
+                     (eval_perc_price_change_avg > self.price_percentage_threshold))
+
+        for i in np.flatnonzero(breakouts):
+            symbol = full[i]
+            bar = pd.Timestamp(self.minute_history[symbol].last_timestamp, unit='ms', tz='UTC').tz_convert(tz)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                move = (close[i, -1] - close[i, -2]) / close[i, -2] * 100
+            if not self._fresh(symbol, bar, close[i, -1], move):
+                continue
+            alerts.append((self._alert_frame(self._frame(symbol), symbol), pending[symbol]))
+        return alerts
+
+    def _evaluate_frame(self, symbol):
+        df = self._frame(symbol)
+
+        # trend values:
+        trend_bars = df.head(self.trend_bar_count)
+        trend_price_max = trend_bars["close"].max()
+
+        # evaluation values:
+        eval_bars = df.tail(self.eval_bar_count)
+        eval_volume = eval_bars["volume"].mean()
+        eval_price_avg = eval_bars["close"].mean()
+        eval_perc_price_change_avg = eval_bars["%_price_change"].mean()
+
+        # determine if it should be alerted:
+        if not (eval_price_avg > trend_price_max and eval_volume > self.minimum_bar_volume and
+                eval_perc_price_change_avg > self.price_percentage_threshold):
+            return None
+        last = df.iloc[-1]
+        if not self._fresh(symbol, df.index[-1], last['close'], last['%_price_change']):
+            return None
+        return self._alert_frame(df, symbol)
+
+    # whether the alert passes the alert_filter, the same (key, bar, level, move) as alert_keys
+    def _fresh(self, symbol, bar, close, move):
+        return self.alert_filter is None or self.alert_filter(symbol, bar, close, move)
+
+    # the trend and eval bars of a symbol with their price and volume changes
+    def _frame(self, symbol):
+
+        # strip out only the bars we need
+        df = self.minute_history[symbol].frame(self.trend_bar_count + self.eval_bar_count)
+
+        # price change
+        df['prev_close'] = df['close'].shift()
+        df['price_change'] = df['close']-df['prev_close']
+        df['%_price_change'] = ((df['close']-df['prev_close']) / df['prev_close'])*100
+
+        # volume changes
+        df['prev_volume'] = df['volume'].shift()
+        df['volume_change'] = df['volume']-df['prev_volume']
+        df['%_volume_change'] = ((df['volume']-df['prev_volume']) / df['prev_volume'])*100
+
+        # bar sizes absolute
+        df['bar_size_abs'] = (df['close']-df['open']).abs()
+        return df
+
+    def _alert_frame(self, df, symbol):
+
+        # drop some unecesarry columns
+        df = df.drop(columns=['open','high','low','prev_close','prev_volume','volume_change','%_volume_change'])
+
+        # trim to the last 5 items in the frame, the symbol is only added to the rows shown
+        df = df.tail(5)
+        df.insert(df.columns.get_loc('price_change'), 'symbol', symbol)
+        return df
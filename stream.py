@@ -0,0 +1,320 @@
+import asyncio
+import collections
+import random
+import time
+from datetime import datetime
+from functools import partial
+import metrics
+import sharding
+from fetcher import fetch_history
+from parallel import MinuteBar
+from scheduler import TradingCalendar, nyc
+
+# bars waiting to be evaluated, once full the overflow policy applies
+max_queued_bars = 50000
+
+# drop_oldest drops the oldest queued bar, merge keeps only the newest queued bar of each symbol
+overflow_policy = 'drop_oldest'
+
+# reconnect backoff: base * 2^attempt seconds (at most max_reconnect_delay) plus up to as much jitter
+reconnect_delay = 1.0
+max_reconnect_delay = 60.0
+
+# a connection that has not delivered a bar for this many seconds while the market is open is reconnected,
+# on a sharded stream only the quiet shard is
+stale_seconds = 180
+
+# symbols backfilled from the rest api per request batch
+backfill_batch = 100
+
+# a failed backfill is retried after backfill_retry_delay * 2^attempt seconds (at most
+# max_reconnect_delay), a symbol is released without its missed bars after backfill_retries
+backfill_retry_delay = 2.0
+backfill_retries = 10
+
+
+# bounded queue of the incoming bars, put never blocks the connection's reader
+# the symbols of bars dropped on overflow (or merged away) are kept in dropped so they can be backfilled
+class IngestQueue:
+
+    def __init__(self, maxsize=None, overflow=None):
+        self.maxsize = maxsize or max_queued_bars
+        self.overflow = overflow or overflow_policy
+        if self.overflow not in ('drop_oldest', 'merge'):
+            raise ValueError('unknown overflow policy {}'.format(self.overflow))
+        self.items = collections.OrderedDict() if self.overflow == 'merge' else collections.deque()
+        self.dropped = set()
+        self.ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def _drop(self, bar):
+        self.dropped.add(bar.symbol)
+        metrics.inc('scanner_stream_dropped_total', policy=self.overflow)
+
+    def put(self, bar):
+        if self.overflow == 'merge':
+            queued = self.items.get(bar.symbol)
+            if queued is not None:
+                # a revision of the queued bar replaces it, a newer bar supersedes it
+                if queued.start != bar.start:
+                    self._drop(queued)
+                self.items[bar.symbol] = bar
+            else:
+                if len(self.items) >= self.maxsize:
+                    self._drop(self.items.popitem(last=False)[1])
+                self.items[bar.symbol] = bar
+        else:
+            if len(self.items) >= self.maxsize:
+                self._drop(self.items.popleft())
+            self.items.append(bar)
+        self.ready.set()
+
+    async def get(self):
+        while not self.items:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.overflow == 'merge':
+            return self.items.popitem(last=False)[1]
+        return self.items.popleft()
+
+
+def _start_ms(start):
+    return int(start.timestamp() * 1000)
+
+
+# keeps a (sharded) stream connection running and feeds its minute bars to the handlers
+# looks like a StreamConn to the caller (on / subscribe / run), underneath it
+# - queues the bars in a bounded IngestQueue so a burst never blocks the socket
+# - reconnects with jittered exponential backoff when the connection fails or goes quiet
+# - backfills the bars missed while disconnected (or dropped on overflow) from the rest api,
+#   the live bars of a symbol are held until its backfill is in so its bars stay in order
+# a shard of a ShardedStream that goes quiet is reconnected (and backfilled) on its own
+class StreamRunner:
+
+    # connect returns a new StreamConn (or ShardedStream)
+    def __init__(self, api, connect, calendar=None, maxsize=None, overflow=None):
+        self.api = api
+        self.connect = connect
+        self.calendar = calendar or TradingCalendar(api)
+        self.queue = IngestQueue(maxsize, overflow)
+        self.handlers = []
+        self.channels = []
+        self.conn = None
+        self.task = None
+        # the time of the last message and the time it connected, by underlying connection
+        self.last_message = {}
+        self.connected_at = {}
+        self.last_seen = {}
+        self.started_ms = None
+        self.pending_backfill = set()
+        # failed backfill attempts of a symbol and the loop time it is retried at
+        self.backfill_attempts = {}
+        self.retry_at = {}
+        self.held = {}
+        self.backfilling = None
+        self.rebalancing = None
+
+    def on(self, channel_pat):
+        def register(func):
+            self.handlers.append((channel_pat, func))
+            return func
+        return register
+
+    # starts the runner in the background, like StreamConn.subscribe it returns once it is running
+    async def subscribe(self, channels):
+        self.channels = list(dict.fromkeys(self.channels + list(channels)))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run_forever())
+
+    # blocks running the stream, like StreamConn.run
+    def run(self, initial_channels=[]):
+        self.channels = list(initial_channels)
+        asyncio.get_event_loop().run_until_complete(self.run_forever())
+
+    async def _ingest(self, conn, channel, data):
+        self.last_message[conn] = time.monotonic()
+        self.queue.put(MinuteBar(data.symbol, data.start, data.open, data.high, data.low, data.close, data.volume))
+
+    async def _open(self):
+        conn = self.connect()
+        for channel_pat in dict.fromkeys(channel_pat for channel_pat, _ in self.handlers):
+            conn.on(channel_pat)(self._ingest)
+        await conn.subscribe(self.channels)
+        # sharded connections follow the message rates measured on them
+        if hasattr(conn, 'rebalance_every') and sharding.rebalance_interval:
+            self.rebalancing = asyncio.ensure_future(conn.rebalance_every(sharding.rebalance_interval))
+        return conn
+
+    async def _close(self):
+        conn, self.conn = self.conn, None
+        if self.rebalancing is not None:
+            self.rebalancing.cancel()
+            self.rebalancing = None
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception as e:
+                print('Error closing the stream: ', e)
+
+    def _market_open(self):
+        now = datetime.now(nyc)
+        session = self.calendar.session(now.date())
+        return session is not None and session[0] <= now <= session[1]
+
+    # the underlying connections, one per shard
+    def _connections(self):
+        return list(getattr(self.conn, 'connections', [self.conn]))
+
+    def _connected(self):
+        now = time.monotonic()
+        self.last_message = {}
+        self.connected_at = {conn: now for conn in self._connections()}
+
+    # reconnects the shards that have gone quiet while the market is open, returns once an
+    # unsharded connection has gone quiet
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(min(stale_seconds, 30))
+            if not self._market_open():
+                continue
+            for shard, conn in enumerate(self._connections()):
+                # a new connection is given stale_seconds from when it opened
+                quiet = time.monotonic() - max(self.last_message.get(conn, 0), self.connected_at[conn])
+                if quiet <= stale_seconds:
+                    continue
+                if not hasattr(self.conn, 'reconnect'):
+                    print('No bars for {:.0f}s, reconnecting'.format(quiet))
+                    return
+                print('No bars on stream shard {} for {:.0f}s, reconnecting it'.format(shard, quiet))
+                await self._reconnect_shard(shard)
+
+    async def _reconnect_shard(self, shard):
+        old = self._connections()[shard]
+        conn = await self.conn.reconnect(shard)
+        self.last_message.pop(old, None)
+        self.connected_at.pop(old, None)
+        self.connected_at[conn] = time.monotonic()
+        metrics.inc('scanner_stream_reconnects_total')
+        symbols = self.conn.symbols_of(shard)
+        print('Stream shard {} reconnected, backfilling {} symbols'.format(shard, len(symbols)))
+        self.request_backfill(symbols)
+
+    # reconnects until cancelled, the attempt count only resets once a connection has been up
+    async def run_forever(self):
+        self.started_ms = self.started_ms or int(time.time() * 1000)
+        consumer = asyncio.ensure_future(self.consume())
+        attempt = 0
+        try:
+            while True:
+                try:
+                    self.conn = await self._open()
+                    self._connected()
+                    if attempt:
+                        print('Stream reconnected, backfilling {} symbols'.format(len(self.symbols())))
+                        self.request_backfill(self.symbols())
+                    attempt = 0
+                    await self._watch()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print('Stream error: ', e)
+                await self._close()
+                metrics.inc('scanner_stream_reconnects_total')
+                delay = min(max_reconnect_delay, reconnect_delay * 2 ** attempt)
+                delay += random.uniform(0, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            consumer.cancel()
+            await self._close()
+
+    def symbols(self):
+        return [channel.partition('.')[2] for channel in self.channels]
+
+    # evaluates the queued bars in order, the bars of a symbol waiting for its backfill are held
+    async def consume(self):
+        while True:
+            bar = await self.queue.get()
+            if self.queue.dropped:
+                self.request_backfill(self.queue.dropped)
+                self.queue.dropped = set()
+            if bar.symbol in self.pending_backfill:
+                self.held.setdefault(bar.symbol, []).append(bar)
+                continue
+            await self._handle(bar)
+
+    async def _handle(self, bar):
+        self.last_seen[bar.symbol] = max(self.last_seen.get(bar.symbol, 0), _start_ms(bar.start))
+        for _, func in self.handlers:
+            await func(self, 'AM', bar)
+
+    # since maps symbols to the epoch ms of the last bar they have already seen
+    def request_backfill(self, symbols, since=None):
+        for symbol, timestamp in (since or {}).items():
+            self.last_seen[symbol] = max(self.last_seen.get(symbol, 0), timestamp)
+        self.pending_backfill.update(symbols)
+        if self.backfilling is None or self.backfilling.done():
+            self.backfilling = asyncio.ensure_future(self.backfill())
+
+    # fetches the minute bars after the last one seen of each symbol waiting for a backfill, feeds
+    # them to the handlers and then releases the live bars held meanwhile, a batch at a time
+    # the symbols whose fetch failed stay pending (their live bars held) and are retried with backoff
+    async def backfill(self):
+        loop = asyncio.get_event_loop()
+        while self.pending_backfill:
+            now = loop.time()
+            ready = [symbol for symbol in self.pending_backfill if self.retry_at.get(symbol, 0) <= now]
+            if not ready:
+                await asyncio.sleep(min(self.retry_at[symbol] for symbol in self.pending_backfill) - now)
+                continue
+            batch = sorted(ready)[:backfill_batch]
+            since = {symbol: self.last_seen.get(symbol, self.started_ms) for symbol in batch}
+            _from = datetime.fromtimestamp(min(since.values()) / 1000, nyc).strftime('%Y-%m-%d')
+            to = datetime.now(nyc).strftime('%Y-%m-%d')
+            try:
+                with metrics.timer('backfill'):
+                    history = await loop.run_in_executor(None, partial(
+                        fetch_history, self.api, batch, multiplier=1, timespan='minute', _from=_from, to=to
+                    ))
+            except Exception as e:
+                print('Backfill failed: ', e)
+                history = {}
+
+            for symbol in batch:
+                # fetch_history leaves out the symbols it failed to fetch
+                if symbol not in history and not self._retry(symbol):
+                    continue
+                df = history.get(symbol)
+                held = self.held.get(symbol)
+                until = _start_ms(held[0].start) if held else None
+                if df is not None and len(df):
+                    starts = df.index.values.astype('datetime64[ms]').astype('i8')
+                    rows = (starts > since[symbol]) & (starts < until if until is not None else True)
+                    missed = df[rows]
+                    metrics.inc('scanner_stream_backfilled_bars_total', len(missed))
+                    for start, row in zip(missed.index, missed.itertuples(index=False)):
+                        await self._handle(MinuteBar(symbol, start.to_pydatetime(), row.open, row.high,
+                                                     row.low, row.close, row.volume))
+                # bars keep being held while the held ones are handled, the symbol is released
+                # once none are left
+                while self.held.get(symbol):
+                    for bar in self.held.pop(symbol):
+                        await self._handle(bar)
+                self.pending_backfill.discard(symbol)
+                self.backfill_attempts.pop(symbol, None)
+                self.retry_at.pop(symbol, None)
+
+    # schedules the retry of a symbol whose backfill failed, returns False while it is retried and
+    # True once it has run out of retries and is to be released without its missed bars
+    def _retry(self, symbol):
+        attempt = self.backfill_attempts.get(symbol, 0)
+        if attempt >= backfill_retries:
+            print('Backfill of {} failed {} times, releasing it without the missed bars'.format(symbol, attempt))
+            metrics.inc('scanner_stream_backfill_failed_total')
+            return True
+        self.backfill_attempts[symbol] = attempt + 1
+        delay = min(max_reconnect_delay, backfill_retry_delay * 2 ** attempt)
+        self.retry_at[symbol] = asyncio.get_event_loop().time() + delay
+        return False
@@ -0,0 +1,95 @@
+import threading
+import time
+import numpy as np
+import metrics
+
+# seconds the tradable asset list is kept before it is fetched again (assets change once a day)
+asset_ttl_seconds = 12 * 60 * 60
+
+# seconds the ticker snapshot (last price, previous day volume) is kept before it is fetched again
+snapshot_ttl_seconds = 60
+
+
+# cached tradable universe shared by the scanners
+# the asset list and the polygon snapshot are refreshed on their own ttl and kept as
+# a hashed symbol set plus aligned numpy arrays, so the price / volume filters are array masks
+# it is filtered from the event loop and from executor threads, the lock keeps the arrays aligned
+class Universe:
+
+    def __init__(self, api, asset_ttl=None, snapshot_ttl=None):
+        self.api = api
+        self.asset_ttl = asset_ttl_seconds if asset_ttl is None else asset_ttl
+        self.snapshot_ttl = snapshot_ttl_seconds if snapshot_ttl is None else snapshot_ttl
+        self.tradable = frozenset()
+        self.assets_updated = None
+        self.symbols = np.empty(0, dtype=object)
+        self.last_price = np.empty(0)
+        self.prev_volume = np.empty(0)
+        self.positions = {}
+        self.snapshot_updated = None
+        self.lock = threading.RLock()
+
+    def _expired(self, updated, ttl):
+        return updated is None or time.monotonic() - updated >= ttl
+
+    # returns the set of tradable symbols, refreshing it once the ttl has passed
+    def assets(self):
+        if self._expired(self.assets_updated, self.asset_ttl):
+            print('Getting tradable assets...')
+            with metrics.timer('universe_fetch'):
+                self.tradable = frozenset(asset.symbol for asset in self.api.list_assets() if asset.tradable)
+            self.assets_updated = time.monotonic()
+            # the snapshot only holds tradable symbols, so it has to follow the asset list
+            self.snapshot_updated = None
+        return self.tradable
+
+    # refreshes the snapshot arrays of the tradable tickers once the ttl has passed
+    def snapshot(self):
+        tradable = self.assets()
+        if self._expired(self.snapshot_updated, self.snapshot_ttl):
+            print('Getting current ticker data...')
+            with metrics.timer('universe_fetch'):
+                tickers = [ticker for ticker in self.api.polygon.all_tickers() if ticker.ticker in tradable]
+            self.symbols = np.array([ticker.ticker for ticker in tickers], dtype=object)
+            self.last_price = np.array([ticker.lastTrade['p'] for ticker in tickers], dtype=float)
+            self.prev_volume = np.array([ticker.prevDay['v'] for ticker in tickers], dtype=float)
+            self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+            self.snapshot_updated = time.monotonic()
+        return self
+
+    # the asset list and ticker snapshot with their ages, for a warm start (see snapshot.py)
+    def state(self):
+        now = time.monotonic()
+        return {
+            'tradable': self.tradable, 'symbols': self.symbols, 'last_price': self.last_price,
+            'prev_volume': self.prev_volume,
+            'assets_age': None if self.assets_updated is None else now - self.assets_updated,
+        }
+
+    # restores a saved state that is age seconds old, the asset list keeps its age while the ticker
+    # snapshot counts as fresh so the first scans run without waiting on the api
+    def restore(self, state, age=0):
+        if state['assets_age'] is None:
+            return
+        self.tradable = state['tradable']
+        self.assets_updated = time.monotonic() - state['assets_age'] - age
+        self.symbols = state['symbols']
+        self.last_price = state['last_price']
+        self.prev_volume = state['prev_volume']
+        self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.snapshot_updated = time.monotonic()
+
+    # returns the tradable symbols with min_price <= last price <= max_price and
+    # previous day volume > min_volume, any limit left as None is not applied
+    def filter(self, min_price=None, max_price=None, min_volume=None):
+        with self.lock:
+            self.snapshot()
+            with metrics.timer('filter'):
+                mask = np.ones(len(self.symbols), dtype=bool)
+                if min_price is not None:
+                    mask &= self.last_price >= min_price
+                if max_price is not None:
+                    mask &= self.last_price <= max_price
+                if min_volume is not None:
+                    mask &= self.prev_volume > min_volume
+                return self.symbols[mask].tolist()
@@ -1,8 +1,4 @@
-
-
-
-
-
+from tabulate import tabulate
 
 # function to return the RSI tag
 def apply_rsi_tag(row):
@@ -12,4 +8,12 @@ def apply_rsi_tag(row):
         val = '*OVERBOUGHT*'
     else:
         val = ''
-    return val
\ No newline at end of file
+    return val
+
+# splits a results frame into pages of at most rows rows (one page per message)
+def paginate(df, rows):
+    return [df.iloc[start:start + rows] for start in range(0, len(df), rows)]
+
+# returns the alert message for a results frame
+def format_alert(title, df, floatfmt='g', showindex=False):
+    return title + '\n' + tabulate(df, headers='keys', tablefmt='github', showindex=showindex, floatfmt=floatfmt)
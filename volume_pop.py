@@ -0,0 +1,54 @@
+import time
+import numpy as np
+import pandas as pd
+from panel import panel_from_records
+import metrics
+
+# columns of the volume pop alert table
+RESULT_COLUMNS = ['symbol', 'price_change', 'perc_change', 'volume', 'trend_volume', 'volume_factor']
+
+
+# computes the volume pop indicators of every symbol of a panel of its last trend + eval bars at once
+# the eval bars' average volume against the trend bars' average volume, and the price move of the
+# eval bars from the close of the last trend bar
+# a symbol without the full trend + eval bars gets nan indicators
+def compute_volume_pops(panel, trend_bar_count, eval_bar_count):
+    close = panel['close'][:, -(trend_bar_count + eval_bar_count):]
+    volume = panel['volume'][:, -(trend_bar_count + eval_bar_count):]
+    trend_volume = volume[:, :trend_bar_count].mean(axis=1)
+    eval_volume = volume[:, trend_bar_count:].mean(axis=1)
+    base_close = close[:, trend_bar_count - 1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        price_change = close[:, -1] - base_close
+        return {
+            'price_change': price_change,
+            'perc_change': (price_change / base_close) * 100,
+            'volume': eval_volume,
+            'trend_volume': trend_volume,
+            'volume_factor': eval_volume / trend_volume,
+        }
+
+
+# scans the daily bars of every symbol for an eval period whose volume beats the trend average by
+# vol_pop_multiplier with a price move over the threshold, in one pass over the (symbol x bar) panel
+# bars is a dict of bar record arrays (see bar_store), returns the alert rows indexed by the last bar's date
+def scan_volume_pops(bars, trend_bar_count, eval_bar_count, vol_pop_multiplier, price_change_threshold,
+                     symbols=None):
+    started = time.perf_counter()
+    panel = panel_from_records(bars, symbols, length=trend_bar_count + eval_bar_count)
+    indicators = compute_volume_pops(panel, trend_bar_count, eval_bar_count)
+    rows = np.flatnonzero((indicators['volume_factor'] > vol_pop_multiplier) &
+                          (np.abs(indicators['price_change']) > price_change_threshold))
+    metrics.observe('scanner_stage_seconds', time.perf_counter() - started, stage='indicators')
+    metrics.inc('scanner_bars_processed_total', int(np.count_nonzero(~np.isnan(panel['close']))), scan='volume_pop')
+    metrics.inc('scanner_symbols_skipped_total', len(symbols or bars) - len(panel), reason='no history')
+
+    # the biggest pops first
+    rows = rows[np.argsort(-indicators['volume_factor'][rows], kind='stable')]
+    index = panel.times(rows, -1).strftime('%x')
+    index.name = 'timestamp'
+    return pd.DataFrame({
+        'symbol': np.array(panel.symbols, dtype=object)[rows],
+        **{column: indicators[column][rows] for column in RESULT_COLUMNS[1:]},
+    }, index=index, columns=RESULT_COLUMNS)